@@ -0,0 +1,159 @@
+"""
+Пакетное решение задач о рюкзаке.
+
+Читает задачи из файла JSON lines или CSV, решает их параллельно в пуле
+процессов и записывает результат каждой задачи в файл JSON lines сразу
+по готовности (порядок результатов может не совпадать с порядком задач).
+
+Формат JSON lines, одна задача в строке:
+    {"id": "a1", "items": [[объем, стоимость], ...], "max_volume": 50,
+     "params": {"max_specimen": 200}, "launcher": false}
+params -- параметры BackpackFactory (или BackpackFactoryParallelLauncher
+при "launcher": true). Предмет может задаваться как [объем, стоимость,
+[расход ресурсов], максимальное количество] вместе с параметром
+max_resources (см. BackpackFactory). Вместо "items" можно указать
+"catalog" -- путь к каталогу предметов, сохраненному ItemCatalog.save:
+столбцы отображаются в память, а не разбираются из JSON.
+
+Формат CSV: столбцы id, volumes, costs (значения через ";"), max_volume,
+launcher; остальные столбцы считаются параметрами.
+
+Пример:
+    python batch.py tasks.jsonl results.jsonl --workers 8
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from models import (Backpack, BackpackFactory, BackpackFactoryParallelLauncher,
+                    Item, ItemCatalog)
+
+CSV_COLUMNS = ("id", "volumes", "costs", "max_volume", "launcher")
+
+
+def parse_csv_value(value):
+    """Преобразует значение параметра из CSV в число, если это возможно."""
+
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def read_tasks(path):
+    """Читает задачи из файла JSON lines или CSV."""
+
+    with open(path, newline="") as file:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(file):
+                yield {"id": row["id"],
+                       "items": list(zip(map(int, row["volumes"].split(";")),
+                                         map(int, row["costs"].split(";")))),
+                       "max_volume": int(row["max_volume"]),
+                       "launcher": row.get("launcher", "").lower() in ("1", "true"),
+                       "params": {key: parse_csv_value(value)
+                                  for key, value in row.items()
+                                  if key not in CSV_COLUMNS and value != ""}}
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def task_items(task):
+    """Возвращает предметы задачи: список Item или ItemCatalog."""
+
+    if "catalog" in task:
+        return ItemCatalog.load(task["catalog"])
+    return [Item(number, *item) for number, item in enumerate(task["items"])]
+
+
+def solve_task(task):
+    """Решает одну задачу и возвращает результат."""
+
+    items = task_items(task)
+    max_volume = task["max_volume"]
+    params = task.get("params", {})
+    start = time.perf_counter()
+
+    if task.get("launcher"):
+        summaries = []
+
+        def on_migration(event):
+            summaries[:] = event["summaries"]
+
+        # процессы пула уже заняты задачами, острова развиваются в них же
+        launcher = BackpackFactoryParallelLauncher(
+            items, max_volume, quiet=True, parallel=False,
+            callbacks=[on_migration], **params)
+        item_counts = list(launcher.solve().item_counts)
+        generations = sum(summary["epochs_evolved"] for summary in summaries)
+    else:
+        factory = BackpackFactory(items, max_volume, quiet=True, **params)
+        item_counts = list(factory.solve().item_counts)
+        generations = factory.epochs_evolved
+
+    backpack = Backpack(items, item_counts)
+    return {"id": task.get("id"),
+            "item_counts": item_counts,
+            "cost": backpack.cost,
+            "volume": backpack.volume,
+            "generations": generations,
+            "wall_time": time.perf_counter() - start}
+
+
+def solve_batch(tasks, output, workers=None, max_pending=None):
+    """
+    Решает задачи в пуле процессов и пишет результаты в output.
+
+    Задачи читаются по мере освобождения процессов, поэтому в памяти
+    одновременно находится не больше max_pending задач.
+    """
+
+    workers = workers or os.cpu_count()
+    max_pending = max_pending or 4 * workers
+    tasks = iter(tasks)
+    solved = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        while True:
+            for task in tasks:
+                pending[executor.submit(solve_task, task)] = task
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"id": task.get("id"), "error": repr(e)}
+                output.write(json.dumps(result) + "\n")
+                solved += 1
+            output.flush()
+    return solved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tasks", help="Файл задач (.jsonl или .csv)")
+    parser.add_argument("results", help="Файл результатов (.jsonl)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Количество процессов (по умолчанию по числу ядер)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with open(args.results, "w") as output:
+        solved = solve_batch(read_tasks(args.tasks), output, args.workers)
+    print(f"Решено задач: {solved} за {time.perf_counter() - start:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
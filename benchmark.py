@@ -0,0 +1,214 @@
+"""
+Замеры производительности генетического алгоритма.
+
+Запускает тестовые наборы из main.py и сгенерированные большие наборы
+через BackpackFactory и BackpackFactoryParallelLauncher с фиксированными
+зернами и выводит по каждому запуску: поколений в секунду, вычислений в
+секунду, время до нахождения оптимума, пиковую память и отклонение от
+точного оптимума. Точное решение динамическим программированием и
+исключение доминируемых предметов отключены: иначе случайные наборы
+сводятся к одному предмету и решаются без эволюции.
+
+Пример:
+    python benchmark.py --engine numpy --sizes 100 1000 --output bench.jsonl
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+from main import TEST_CASES
+from models import (BackpackFactory, BackpackFactoryParallelLauncher, Item,
+                    solve_exact)
+
+
+def generate_items(types_count, seed, max_item_volume=100, max_item_cost=100):
+    """Создает случайный набор предметов."""
+
+    rng = random.Random(seed)
+    return [Item(i, rng.randint(1, max_item_volume), rng.randint(1, max_item_cost))
+            for i in range(types_count)]
+
+
+def exact_optimum(items, max_volume):
+    """Находит оптимальную стоимость динамическим программированием."""
+
+    return solve_exact(items, max_volume)[0].cost
+
+
+def create_instances(sizes, capacities, seed):
+    """Возвращает список наборов (название, предметы, объем, оптимум)."""
+
+    instances = [(f"test_case_{number}", items, max_volume, optimum)
+                 for number, (items, max_volume, optimum) in TEST_CASES.items()]
+    for types_count in sizes:
+        items = generate_items(types_count, seed + types_count)
+        for max_volume in capacities:
+            instances.append((f"random_{types_count}x{max_volume}",
+                              items,
+                              max_volume,
+                              exact_optimum(items, max_volume)))
+    return instances
+
+
+def run_factory(items, max_volume, optimum, seed, **params):
+    """Решает набор одной популяцией и возвращает замеры."""
+
+    reached = {}
+    start = time.perf_counter()
+
+    def on_event(event):
+        if "time" not in reached and event["best_cost"] >= optimum:
+            reached["time"] = time.perf_counter() - start
+
+    factory = BackpackFactory(items, max_volume, seed=seed, quiet=True,
+                              callbacks=[on_event], **params)
+    factory.evolve()
+    wall_time = time.perf_counter() - start
+
+    return {"generations": factory.epochs_evolved,
+            "evaluations": factory.counters["evaluations"],
+            "best_cost": factory.best_backpack.cost,
+            "wall_time": wall_time,
+            "time_to_optimum": reached.get("time"),
+            "timings": factory.timings}
+
+
+def run_launcher(items, max_volume, optimum, seed, **params):
+    """Решает набор островной моделью и возвращает замеры."""
+
+    reached = {}
+    summaries = []
+    start = time.perf_counter()
+
+    def on_event(event):
+        summaries[:] = event["summaries"]
+        if "time" not in reached and event["best_cost"] >= optimum:
+            reached["time"] = time.perf_counter() - start
+
+    launcher = BackpackFactoryParallelLauncher(items, max_volume, seed=seed,
+                                               quiet=True,
+                                               callbacks=[on_event], **params)
+    launcher.evolve()
+    launcher.close()
+    wall_time = time.perf_counter() - start
+
+    return {"generations": sum(summary["epochs_evolved"] for summary in summaries),
+            "evaluations": sum(summary["counters"]["evaluations"]
+                               for summary in summaries),
+            "best_cost": max(summary["best_cost"] for summary in summaries),
+            "wall_time": wall_time,
+            "time_to_optimum": reached.get("time"),
+            "timings": launcher.timings}
+
+
+def measure(run, items, max_volume, optimum, seed, memory=False, **params):
+    """Выполняет запуск и дополняет замеры производными величинами."""
+
+    result = run(items, max_volume, optimum, seed, **params)
+    wall_time = result["wall_time"]
+    result["generations_per_sec"] = result["generations"] / wall_time
+    result["evaluations_per_sec"] = result["evaluations"] / wall_time
+    result["optimum"] = optimum
+    result["gap"] = (optimum - result["best_cost"]) / optimum if optimum else 0.
+
+    if memory:
+        # отдельный запуск: tracemalloc сильно замедляет работу и видит
+        # только текущий процесс, поэтому острова запускаются в нем же
+        if run is run_launcher:
+            params = dict(params, parallel=False)
+        tracemalloc.start()
+        run(items, max_volume, optimum, seed, **params)
+        result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        result["peak_memory"] = None
+
+    return result
+
+
+def print_result(result):
+    time_to_optimum = result["time_to_optimum"]
+    peak_memory = result["peak_memory"]
+    print(f"{result['instance']:<22} {result['mode']:<9} {result['engine']:<7}"
+          f"{result['generations_per_sec']:>10.1f} "
+          f"{result['evaluations_per_sec']:>12.0f} "
+          f"{'-' if time_to_optimum is None else f'{time_to_optimum:.3f}':>9} "
+          f"{result['wall_time']:>8.3f} "
+          f"{'-' if peak_memory is None else f'{peak_memory / 2 ** 20:.1f}':>8} "
+          f"{result['gap']:>7.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", nargs="+", default=["python", "numpy"],
+                        choices=["python", "numpy"])
+    parser.add_argument("--mode", nargs="+", default=["factory", "launcher"],
+                        choices=["factory", "launcher"])
+    parser.add_argument("--sizes", nargs="*", type=int, default=[100, 1000, 10000],
+                        help="Количества типов предметов в сгенерированных наборах")
+    parser.add_argument("--capacities", nargs="*", type=int, default=[1000, 5000],
+                        help="Объемы рюкзака в сгенерированных наборах")
+    parser.add_argument("--max-generations", type=int, default=200)
+    parser.add_argument("--max-specimen", type=int, default=100)
+    parser.add_argument("--n-populations", type=int, default=4)
+    parser.add_argument("--n-migrations", type=int, default=10)
+    parser.add_argument("--migration-delay", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--memory", action="store_true",
+                        help="Замерять пиковую память (дополнительный запуск)")
+    parser.add_argument("--output", help="Файл для результатов в формате JSON lines")
+    args = parser.parse_args()
+
+    instances = create_instances(args.sizes, args.capacities, args.seed)
+    output = open(args.output, "w") if args.output else None
+
+    print(f"{'Набор':<22} {'Режим':<9} {'Движок':<7}{'Покол./с':>10} "
+          f"{'Вычисл./с':>12} {'До опт.':>9} {'Время':>8} {'Память':>8} "
+          f"{'Откл.':>7}")
+    for name, items, max_volume, optimum in instances:
+        for engine in args.engine:
+            for mode in args.mode:
+                if mode == "factory":
+                    result = measure(run_factory, items, max_volume, optimum,
+                                     args.seed, args.memory,
+                                     engine=engine,
+                                     max_generations=args.max_generations,
+                                     max_specimen=args.max_specimen,
+                                     epsilon=0,
+                                     preprocess=False,
+                                     exact_threshold=None)
+                else:
+                    rng = random.Random(args.seed)
+                    populations_params = [
+                        {"alpha": 2,
+                         "max_specimen": args.max_specimen,
+                         "crossover_type": rng.choice(["avg", "rand"]),
+                         "crossover_probability": 1 - rng.random() / 2,
+                         "mutation_probability": rng.random() / 4}
+                        for _ in range(args.n_populations)]
+                    result = measure(run_launcher, items, max_volume, optimum,
+                                     args.seed, args.memory,
+                                     engine=engine,
+                                     n_populations=args.n_populations,
+                                     populations_params=populations_params,
+                                     migration_delay=args.migration_delay,
+                                     n_migrations=args.n_migrations,
+                                     epsilon=0,
+                                     preprocess=False,
+                                     exact_threshold=None)
+
+                result.update({"instance": name, "mode": mode, "engine": engine})
+                print_result(result)
+                if output is not None:
+                    output.write(json.dumps(result) + "\n")
+                    output.flush()
+
+    if output is not None:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Распределенный запуск популяций по TCP.
+
+Координатор ждет подключения рабочих процессов и раздает им популяции
+BackpackFactoryParallelLauncher: каждая популяция развивается в одном из
+рабочих, между координатором и рабочими передаются только команды,
+геномы мигрантов и сведения о популяциях. Рабочий может обслуживать
+несколько популяций. Если рабочий отключился, его популяции создаются
+заново на оставшихся рабочих (или в процессе координатора) из лучших
+известных особей.
+
+Соединения передают объекты pickle, поэтому знающий ключ может выполнить
+произвольный код на координаторе и рабочих. Координатор должен слушать
+только доверенную сеть (частную сеть, VPN или туннель SSH), а ключ
+передается рабочим по защищенному каналу. Ключ задается параметром
+--authkey или переменной окружения BACKPACK_AUTHKEY; если координатор
+запущен без ключа, он создает случайный и выводит его в stderr.
+
+Каталог предметов, открытый из файлов (см. ItemCatalog.load),
+передается рабочим путем к файлам, поэтому файлы должны быть доступны
+рабочим по тому же пути (общая файловая система). Иначе рабочий
+отвечает ошибкой загрузки, и решение завершается ею на координаторе.
+
+Пример (на каждой машине запускается рабочий):
+    python distributed.py solve task.json --address 10.0.0.1:6000 --workers 2
+    BACKPACK_AUTHKEY=<ключ> python distributed.py worker 10.0.0.1:6000
+"""
+import argparse
+import itertools
+import json
+import os
+import pickle
+import secrets
+import sys
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from batch import read_tasks, task_items
+from models import BackpackFactoryParallelLauncher, LocalIsland
+
+
+def parse_address(address):
+    """Преобразует строку "host:port" в пару (host, port)."""
+
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+class RemoteWorker:
+    """
+    Подключение координатора к рабочему процессу.
+
+    Ответы рабочего помечены номером популяции, ответы, пришедшие раньше
+    ожидаемого, откладываются до запроса. Аргументы команды сериализуются
+    отдельно: если рабочий не может их загрузить (например, каталог
+    предметов по пути, которого нет на его машине), он отвечает ошибкой
+    этой популяции, а не завершается.
+
+    :param connection: Соединение с рабочим
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.results = {}
+        self.alive = True
+
+    def send(self, island_id, method, args):
+        self.connection.send((island_id, method, pickle.dumps(args)))
+
+    def recv(self, island_id):
+        while island_id not in self.results:
+            result_id, result = self.connection.recv()
+            self.results[result_id] = result
+        return self.results.pop(island_id)
+
+    def close(self):
+        if self.alive:
+            try:
+                self.connection.send((None, None, ()))
+            except OSError:
+                pass
+        self.alive = False
+        self.connection.close()
+
+
+class RemoteIsland:
+    """
+    Популяция, развивающаяся в рабочем процессе на другой машине.
+
+    Команды передаются через send/recv так же, как и ProcessIsland. Если
+    соединение с рабочим разорвано, популяция создается заново на другом
+    рабочем (см. recover) и команда повторяется.
+
+    :param coordinator: Координатор, раздающий популяции
+    :param factory_params: Параметры BackpackFactory
+    """
+
+    def __init__(self, coordinator, **factory_params):
+        self.coordinator = coordinator
+        self.factory_params = factory_params
+        self.island_id = next(coordinator.island_ids)
+        self.best_item_counts = None  # лучшая особь из последних сведений
+        self.command = None
+        self.worker = None
+        self.local_island = None
+        self.start(factory_params)
+
+    def start(self, factory_params):
+        """Создает популяцию на живом рабочем или локально."""
+
+        self.worker = self.coordinator.get_worker()
+        if self.worker is None:
+            self.local_island = LocalIsland(**factory_params)
+            return
+        try:
+            self.worker.send(self.island_id, "create", (factory_params,))
+        except OSError:
+            self.coordinator.drop(self.worker)
+            self.start(factory_params)
+
+    def recover(self):
+        """Создает популяцию заново из лучшей известной особи."""
+
+        factory_params = dict(self.factory_params)
+        if self.best_item_counts is not None:
+            factory_params["initial_item_counts"] = [self.best_item_counts]
+        self.start(factory_params)
+        if self.command[0] != "evolve":
+            # новой популяции нужно стартовое поколение
+            self.send("evolve", 1)
+            self.recv()
+
+    def send(self, method, *args):
+        self.command = (method, args)
+        if self.local_island is not None:
+            self.local_island.send(method, *args)
+            return
+        try:
+            self.worker.send(self.island_id, method, args)
+        except OSError:
+            self.coordinator.drop(self.worker)
+            self.recover()
+            self.send(method, *args)
+
+    def recv(self):
+        if self.local_island is not None:
+            result = self.local_island.recv()
+        else:
+            try:
+                result = self.worker.recv(self.island_id)
+            except (EOFError, OSError):
+                method, args = self.command
+                self.coordinator.drop(self.worker)
+                self.recover()
+                self.send(method, *args)
+                return self.recv()
+
+        if isinstance(result, Exception):
+            raise result
+        if isinstance(result, dict) and "best_item_counts" in result:
+            self.best_item_counts = result["best_item_counts"]
+        return result
+
+    def close(self):
+        if self.local_island is None and self.worker.alive:
+            try:
+                self.worker.send(self.island_id, "close", ())
+            except OSError:
+                self.coordinator.drop(self.worker)
+
+
+class Coordinator:
+    """
+    Координатор рабочих процессов.
+
+    Передается в BackpackFactoryParallelLauncher(coordinator=...), после
+    чего популяции запускателя создаются на подключенных рабочих по
+    очереди.
+
+    :param address: Адрес (host, port) для подключения рабочих, только
+        в доверенной сети
+    :param authkey: Ключ (bytes), которым рабочие подтверждают
+        подключение
+    """
+
+    def __init__(self, address, authkey):
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+        self.workers = []
+        self.island_ids = itertools.count()
+        self.next_worker = 0
+
+    def accept(self, n_workers):
+        """
+        Ждет подключения n_workers рабочих, подключения с неверным ключом
+        отклоняются.
+        """
+
+        while n_workers > 0:
+            try:
+                connection = self.listener.accept()
+            except (AuthenticationError, OSError) as e:
+                print(f"Подключение отклонено: {e!r}", file=sys.stderr)
+                continue
+            self.workers.append(RemoteWorker(connection))
+            n_workers -= 1
+
+    def get_worker(self):
+        """Возвращает следующего живого рабочего или None."""
+
+        workers = [worker for worker in self.workers if worker.alive]
+        if not workers:
+            return None
+        self.next_worker = (self.next_worker + 1) % len(workers)
+        return workers[self.next_worker]
+
+    def drop(self, worker):
+        """Исключает отключившегося рабочего."""
+
+        if worker.alive:
+            print("Рабочий отключился, его популяции создаются заново",
+                  file=sys.stderr)
+        worker.alive = False
+
+    def create_island(self, **factory_params):
+        return RemoteIsland(self, **factory_params)
+
+    def close(self):
+        """Завершает рабочих и перестает принимать подключения."""
+
+        for worker in self.workers:
+            worker.close()
+        self.listener.close()
+
+
+def run_worker(address, authkey):
+    """
+    Подключается к координатору и выполняет команды его популяций до
+    завершения координатором.
+    """
+
+    connection = Client(address, authkey=authkey)
+    islands = {}
+    while True:
+        try:
+            island_id, method, args = connection.recv()
+        except EOFError:
+            break
+        if island_id is None:
+            break
+        if method == "close":
+            islands.pop(island_id, None)
+            continue
+
+        try:
+            args = pickle.loads(args)
+            if method == "create":
+                islands[island_id] = LocalIsland(**args[0])
+                continue
+            result = getattr(islands[island_id], method)(*args)
+        except Exception as e:
+            result = e
+        sys.stdout.flush()
+        connection.send((island_id, result))
+    connection.close()
+
+
+def solve_task(task, coordinator):
+    """Решает задачу из файла задач (см. batch.py) на рабочих координатора."""
+
+    launcher = BackpackFactoryParallelLauncher(
+        task_items(task), task["max_volume"], quiet=True, coordinator=coordinator,
+        **task.get("params", {}))
+    backpack = launcher.solve()
+    launcher.close()
+    return {"id": task.get("id"),
+            "item_counts": list(backpack.item_counts),
+            "cost": backpack.cost,
+            "volume": backpack.volume,
+            "stop_reason": launcher.stop_reason}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--authkey",
+                        default=os.environ.get("BACKPACK_AUTHKEY"),
+                        help="Ключ подключения рабочих (по умолчанию "
+                             "BACKPACK_AUTHKEY, для координатора -- случайный)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker_parser = commands.add_parser("worker", help="Запустить рабочего")
+    worker_parser.add_argument("address", help="Адрес координатора host:port")
+    solve_parser = commands.add_parser("solve", help="Решить задачи на рабочих")
+    solve_parser.add_argument("tasks", help="Файл задач (.jsonl или .csv)")
+    solve_parser.add_argument("--address", default="localhost:6000",
+                              help="Адрес для подключения рабочих host:port")
+    solve_parser.add_argument("--workers", type=int, default=1,
+                              help="Количество ожидаемых рабочих")
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        if args.authkey is None:
+            parser.error("рабочему нужен ключ координатора: --authkey или "
+                         "BACKPACK_AUTHKEY")
+        run_worker(parse_address(args.address), args.authkey.encode())
+        return
+
+    if args.authkey is None:
+        args.authkey = secrets.token_hex(16)
+        print(f"Ключ подключения рабочих: {args.authkey}", file=sys.stderr)
+    coordinator = Coordinator(parse_address(args.address),
+                              args.authkey.encode())
+    print(f"Ожидание рабочих: {args.workers}", file=sys.stderr)
+    coordinator.accept(args.workers)
+    try:
+        for task in read_tasks(args.tasks):
+            print(json.dumps(solve_task(task, coordinator)))
+    finally:
+        coordinator.close()
+
+
+if __name__ == "__main__":
+    main()
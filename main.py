@@ -41,13 +41,13 @@ def run_manual(parallel=False):
 
         estimator = BackpackFactory(items,
                                     max_volume,
-                                    alpha,
-                                    max_generations,
-                                    max_specimen,
-                                    crossover_type,
-                                    crossover_probability,
-                                    mutation_probability,
-                                    epsilon)
+                                    alpha=alpha,
+                                    max_generations=max_generations,
+                                    max_specimen=max_specimen,
+                                    crossover_type=crossover_type,
+                                    crossover_probability=crossover_probability,
+                                    mutation_probability=mutation_probability,
+                                    epsilon=epsilon)
         return estimator
 
 
@@ -63,6 +63,42 @@ def run_random(parallel=False):
     return estimator
 
 
+# Тестовые наборы: (предметы, объем рюкзака, оптимальная стоимость)
+TEST_CASES = {
+    1: ([Item(0, 7, 12),
+         Item(1, 3, 2),
+         Item(2, 20, 41)],
+        58,
+        108),
+    2: ([Item(0, 12, 40),
+         Item(1, 20, 60),
+         Item(2, 15, 50)],
+        45,
+        150),
+    3: ([Item(0, 4, 28),
+         Item(1, 3, 20),
+         Item(2, 2, 13),
+         Item(3, 1, 6)],
+        10,
+        69),
+    4: ([Item(0, 1, 10),
+         Item(1, 3, 40),
+         Item(2, 4, 50),
+         Item(3, 5, 70)],
+        8,
+        110),
+    5: ([Item(0, 8, 14),
+         Item(1, 7, 11),
+         Item(2, 6, 9),
+         Item(3, 5, 7),
+         Item(4, 4, 6),
+         Item(5, 3, 5),
+         Item(6, 2, 2)],
+        50,
+        86)
+}
+
+
 def test_case_1(parallel=False):
     print("Объем рюкзака: 58",
           "Оптимальное решение:",
@@ -71,10 +107,7 @@ def test_case_1(parallel=False):
           sep="\n",
           end="\n")
 
-    items = [Item(0, 7, 12),
-             Item(1, 3, 2),
-             Item(2, 20, 41)]
-    max_volume = 58
+    items, max_volume, _ = TEST_CASES[1]
     if parallel:
         estimator = BackpackFactoryParallelLauncher(items, max_volume)
     else:
@@ -90,10 +123,7 @@ def test_case_2(parallel=False):
           sep="\n",
           end="\n")
 
-    items = [Item(0, 12, 40),
-             Item(1, 20, 60),
-             Item(2, 15, 50)]
-    max_volume = 45
+    items, max_volume, _ = TEST_CASES[2]
     if parallel:
         estimator = BackpackFactoryParallelLauncher(items, max_volume)
     else:
@@ -109,11 +139,7 @@ def test_case_3(parallel=False):
           sep="\n",
           end="\n")
 
-    items = [Item(0, 4, 28),
-             Item(1, 3, 20),
-             Item(2, 2, 13),
-             Item(3, 1, 6)]
-    max_volume = 10
+    items, max_volume, _ = TEST_CASES[3]
     if parallel:
         estimator = BackpackFactoryParallelLauncher(items, max_volume)
     else:
@@ -129,11 +155,7 @@ def test_case_4(parallel=False):
           sep="\n",
           end="\n")
 
-    items = [Item(0, 1, 10),
-             Item(1, 3, 40),
-             Item(2, 4, 50),
-             Item(3, 5, 70)]
-    max_volume = 8
+    items, max_volume, _ = TEST_CASES[4]
     if parallel:
         estimator = BackpackFactoryParallelLauncher(items, max_volume)
     else:
@@ -155,14 +177,7 @@ def test_case_5(parallel=False):
           sep="\n",
           end="\n")
 
-    items = [Item(0, 8, 14),
-             Item(1, 7, 11),
-             Item(2, 6, 9),
-             Item(3, 5, 7),
-             Item(4, 4, 6),
-             Item(5, 3, 5),
-             Item(6, 2, 2)]
-    max_volume = 50
+    items, max_volume, _ = TEST_CASES[5]
     if parallel:
         estimator = BackpackFactoryParallelLauncher(items, max_volume)
     else:
@@ -181,41 +196,42 @@ SWITCH = {
 }
 
 
-clear()
-print("Выберите способ задания начальных условий:")
-print("1. Ручной")
-print("2. Случайный")
-print("3. Тест кейс 1")
-print("4. Тест кейс 2")
-print("5. Тест кейс 3")
-print("6. Тест кейс 4")
-print("7. Тест кейс 5")
-
-case = input()
-if case not in SWITCH:
-    raise ValueError(f"Неизвестный способ задания начальных условий: {case}")
-
-print("Выберите режим работы:")
-print("1. Обычный ГА")
-print("2. Параллельный ГА")
-
-mode = input()
-if mode == "1":
-    mode = False
-elif mode == "2":
-    mode
-else:
-    raise ValueError(f"Неизвестный режим работы: {mode}")
-
-choice = SWITCH[case]
-estimator = choice(mode)
-
-print("Список предметов: ")
-for item in estimator.items:
-    print(item)
-print()
-
-estimator.evolve()
-
-if not mode:
-    estimator.get_info()
+if __name__ == "__main__":
+    clear()
+    print("Выберите способ задания начальных условий:")
+    print("1. Ручной")
+    print("2. Случайный")
+    print("3. Тест кейс 1")
+    print("4. Тест кейс 2")
+    print("5. Тест кейс 3")
+    print("6. Тест кейс 4")
+    print("7. Тест кейс 5")
+
+    case = input()
+    if case not in SWITCH:
+        raise ValueError(f"Неизвестный способ задания начальных условий: {case}")
+
+    print("Выберите режим работы:")
+    print("1. Обычный ГА")
+    print("2. Параллельный ГА")
+
+    mode = input()
+    if mode == "1":
+        mode = False
+    elif mode == "2":
+        mode
+    else:
+        raise ValueError(f"Неизвестный режим работы: {mode}")
+
+    choice = SWITCH[case]
+    estimator = choice(mode)
+
+    print("Список предметов: ")
+    for item in estimator.items:
+        print(item)
+    print()
+
+    estimator.evolve()
+
+    if not mode:
+        estimator.get_info()
@@ -1,6 +1,17 @@
-import random
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from copy import deepcopy
 
+import numpy as np
+
+# количество предмета не ограничено (см. Item.max_count)
+UNLIMITED = np.iinfo(np.int64).max
+
 
 class BackpackFactoryParallelLauncher:
     """
@@ -11,9 +22,56 @@ class BackpackFactoryParallelLauncher:
     :param n_populations: Количество параллельно развивающихся популяций
     :param populations_params: Параметры популяций (если None, то берутся случайные)
     :param migration_delay: Количество поколений перед миграцией
-    :param migration_proba: Вероятность миграции
+    :param migration_proba: Вероятность миграции (доля мигрантов в популяции)
+    :param migration_topology: Куда отправляются мигранты.
+        Ring -- в следующую по кругу популяцию
+        Random -- каждый мигрант в случайную другую популяцию
+        Full -- во все другие популяции
+        Star -- из первой популяции во все, из остальных в первую
+    :param migration_policy: Кого заменяют прибывшие мигранты.
+        Replace_worst -- худших особей популяции
+        Replace_random -- случайных особей популяции
     :param n_migrations: Максимальное кол-во миграций
-    :param epsilon: Точность функции приспособленности
+    :param epsilon: Точность функции приспособленности (если None, то
+        средняя приспособленность не проверяется)
+    :param scheduler: Распределение времени между популяциями.
+        Uniform -- все популяции развиваются до конца
+        Halving -- каждые schedule_interval миграций популяции
+        упорядочиваются по приросту лучшей стоимости на секунду
+        процессорного времени, худшая доля schedule_fraction заменяется
+        новыми популяциями с параметрами лучших, измененными случайно
+        (см. perturb_params), и их лучшими особями
+    :param schedule_interval: Количество миграций между заменами популяций
+    :param schedule_fraction: Доля заменяемых популяций
+    :param time_budget: Ограничение времени эволюции в секундах
+    :param patience: Максимальное количество миграций без улучшения
+        лучшей особи
+    :param target_cost: Стоимость, при достижении которой эволюция
+        останавливается
+    :param preprocess: Исключить из генома не помещающиеся и доминируемые
+        предметы (см. BackpackFactory). Выполняется один раз, популяциям
+        передаются оставшиеся предметы
+    :param exact_threshold: Порог размера задачи для динамического
+        программирования (см. BackpackFactory)
+    :param exact_seeds: Количество решений динамического программирования
+        в стартовом поколении каждой популяции (см. BackpackFactory)
+    :param max_resources: Ограничения дополнительных ресурсов (см.
+        BackpackFactory)
+    :param engine: Представление популяций (см. BackpackFactory)
+    :param parallel: Развивать каждую популяцию в отдельном процессе
+    :param coordinator: Координатор рабочих процессов на других машинах
+        (см. distributed.Coordinator). Если задан, популяции развиваются
+        в рабочих, а parallel не используется
+    :param shared_cache: Использовать общий кэш вычислений для всех
+        популяций (только при parallel=False)
+    :param seed: Зерно генератора случайных чисел (int или
+        np.random.SeedSequence). Популяции получают независимые
+        генераторы из SeedSequence.spawn, поэтому запуск с тем же
+        зерном воспроизводим
+    :param quiet: Ничего не выводить
+    :param callbacks: Функции callback(event), получающие событие
+        "migration" после каждой миграции и "schedule" после каждой
+        замены популяций
     """
 
     def __init__(self,
@@ -24,36 +82,106 @@ class BackpackFactoryParallelLauncher:
                  migration_delay=25,
                  migration_proba=.1,
                  n_migrations=100,
-                 epsilon=.001):
-        self.items = items
-        self.max_volume = max_volume
+                 epsilon=.001,
+                 *,
+                 scheduler="uniform",
+                 schedule_interval=5,
+                 schedule_fraction=.25,
+                 time_budget=None,
+                 patience=None,
+                 target_cost=None,
+                 preprocess=True,
+                 exact_threshold=10 ** 6,
+                 exact_seeds=0,
+                 max_resources=None,
+                 engine="python",
+                 migration_topology="random",
+                 migration_policy="replace_worst",
+                 parallel=True,
+                 coordinator=None,
+                 shared_cache=False,
+                 seed=None,
+                 quiet=False,
+                 callbacks=None):
+        assert not ((parallel or coordinator) and shared_cache), \
+            "Shared cache requires parallel=False"
+        assert migration_topology in ("ring", "random", "full", "star"), \
+            "Invalid migration topology"
+        assert migration_policy in ("replace_worst", "replace_random"), \
+            "Invalid migration policy"
+        assert scheduler in ("uniform", "halving"), "Invalid scheduler"
+        self.preprocess = preprocess
+        self.max_resources = None if max_resources is None \
+            else np.asarray(max_resources).tolist()
+        self.set_items(items, max_volume)
+        self.engine = engine
         self.n_populations = n_populations
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        # генератор запускателя и источник зерен популяций
+        self.seed_sequence = seed
+        self.rng = np.random.default_rng(seed)
         if populations_params is not None:
             assert len(
                 populations_params) == n_populations, "len of populations_params don't match with n_populations"
-            self.populations_params = populations_params
+            self.populations_params = list(populations_params)
         else:
             self.populations_params = [
                 self.generate_random_params() for _ in range(n_populations)]
 
         self.migration_delay = migration_delay
         self.migration_proba = migration_proba
+        self.migration_topology = migration_topology
+        self.migration_policy = migration_policy
         self.n_migrations = n_migrations
+        self.scheduler = scheduler
+        self.schedule_interval = schedule_interval
+        self.schedule_fraction = schedule_fraction
         self.epsilon = epsilon
+        self.time_budget = time_budget
+        self.patience = patience
+        self.target_cost = target_cost
+        self.exact_threshold = exact_threshold
+        self.exact_seeds = exact_seeds
+        self.best_backpack = None  # лучшая особь среди всех популяций
+        self.stop_reason = None
+        self.parallel = parallel
+        self.coordinator = coordinator
+        self.shared_cache = shared_cache
+        self.quiet = quiet
+        self.callbacks = callbacks or []
+        self.timings = {"evolution": 0., "migration": 0.}
         self.init_populations()
-        self.get_info()
+        if not self.quiet:
+            self.get_info()
+
+    def set_items(self, items, max_volume):
+        """Задает предметы и объем рюкзака (см. BackpackFactory.set_items)."""
+
+        self.all_items = items
+        if self.preprocess:
+            self.item_numbers = reduce_items(items, max_volume,
+                                             self.max_resources)
+            items = select_items(items, self.item_numbers)
+        else:
+            self.item_numbers = list(range(len(items)))
+        self.items = items
+        self.max_volume = max_volume
+        self.upper_bound = get_upper_bound(items, max_volume,
+                                           self.max_resources)
 
     def get_info(self):
         for i, population in enumerate(self.populations):
             print(f"Параметры популяции {i+1}:")
-            population.print_hyperparams()
+            population.send("print_hyperparams")
+            population.recv()
 
     def generate_random_params(self):
-        max_specimen = random.randint(25, 1000)
-        alpha = random.randint(0, max_specimen // 10)
-        crossover_type = "avg" if random.randint(0, 1) == 0 else "rand"
-        crossover_probability = 1 - random.random() / 2
-        mutation_probability = random.random() / 4
+        max_specimen = int(self.rng.integers(25, 1000, endpoint=True))
+        alpha = int(self.rng.integers(0, max_specimen // 10, endpoint=True))
+        crossover_type = "avg" if self.rng.integers(2) == 0 else "rand"
+        crossover_probability = 1 - self.rng.random() / 2
+        mutation_probability = self.rng.random() / 4
 
         return {"alpha": alpha,
                 "max_specimen": max_specimen,
@@ -61,58 +189,551 @@ class BackpackFactoryParallelLauncher:
                 "crossover_probability": crossover_probability,
                 "mutation_probability": mutation_probability}
 
+    def perturb_params(self, params):
+        """Возвращает случайно измененные параметры популяции."""
+
+        max_specimen = min(max(round(
+            params["max_specimen"] * 2 ** self.rng.uniform(-.5, .5)), 25), 1000)
+        alpha = min(round(params["alpha"] * 2 ** self.rng.uniform(-.5, .5)),
+                    max_specimen // 10)
+        crossover_type = params["crossover_type"]
+        if self.rng.random() < .2:
+            crossover_type = "rand" if crossover_type == "avg" else "avg"
+        crossover_probability = min(max(
+            params["crossover_probability"] + self.rng.uniform(-.1, .1), .5), 1)
+        mutation_probability = min(max(
+            params["mutation_probability"] + self.rng.uniform(-.05, .05), 0), .5)
+
+        return dict(params,
+                    alpha=alpha,
+                    max_specimen=max_specimen,
+                    crossover_type=crossover_type,
+                    crossover_probability=crossover_probability,
+                    mutation_probability=mutation_probability)
+
     def init_populations(self):
-        populations = []
-        for params in self.populations_params:
-            slave = BackpackFactory(
-                items=self.items,
-                max_volume=self.max_volume,
-                alpha=params["alpha"],
-                max_specimen=params["max_specimen"],
-                crossover_type=params["crossover_type"],
-                crossover_probability=params["crossover_probability"],
-                mutation_probability=params["mutation_probability"],
-                epsilon=self.epsilon
-            )
-
-            populations.append(slave)
-
-        self.populations = populations
+        self.evaluation_cache = EvaluationCache() if self.shared_cache else None
+        self.populations = [self.create_population(params)
+                            for params in self.populations_params]
+        # лучшая стоимость и процессорное время популяций при последнем
+        # упорядочивании (см. schedule)
+        self.schedule_marks = [(0, 0.)] * self.n_populations
+
+    def island_items(self):
+        """
+        Возвращает предметы и позиции оставшихся предметов для популяций.
+
+        Каталог, открытый из файлов (см. ItemCatalog.load), передается
+        целиком: популяции в других процессах отображают те же файлы.
+        Если остались все предметы, позиции не передаются и популяции
+        работают с отображенными столбцами без копирования. Иначе каждая
+        популяция хранит в памяти свою копию оставшихся предметов (см.
+        ItemCatalog.take), обычно гораздо меньшую каталога. Для других
+        видов предметов передаются оставшиеся предметы, позиции не нужны.
+        """
+
+        if isinstance(self.all_items, ItemCatalog) and \
+                self.all_items.path is not None:
+            if len(self.item_numbers) == len(self.all_items):
+                return self.all_items, None
+            return self.all_items, self.item_numbers
+        return self.items, None
+
+    def create_population(self, params, initial_item_counts=None):
+        """Создает популяцию с параметрами params."""
+
+        if self.coordinator is not None:
+            island_type = self.coordinator.create_island
+        elif self.parallel:
+            island_type = ProcessIsland
+        else:
+            island_type = LocalIsland
+        items, item_numbers = self.island_items()
+        return island_type(
+            items=items,
+            max_volume=self.max_volume,
+            alpha=params["alpha"],
+            max_specimen=params["max_specimen"],
+            crossover_type=params["crossover_type"],
+            crossover_probability=params["crossover_probability"],
+            mutation_probability=params["mutation_probability"],
+            epsilon=self.epsilon,
+            preprocess=False,
+            item_numbers=item_numbers,
+            exact_threshold=self.exact_threshold,
+            exact_seeds=self.exact_seeds,
+            initial_item_counts=initial_item_counts,
+            max_resources=self.max_resources,
+            engine=self.engine,
+            evaluation_cache=self.evaluation_cache,
+            seed=self.seed_sequence.spawn(1)[0],
+            quiet=self.quiet
+        )
+
+    def schedule(self, summaries):
+        """
+        Заменяет худшие популяции новыми (см. scheduler="halving").
+
+        Популяции упорядочиваются по приросту лучшей стоимости на секунду
+        процессорного времени с прошлого упорядочивания (при равенстве --
+        по лучшей стоимости). Каждая заменяемая популяция закрывается,
+        вместо нее создается популяция с измененными параметрами одной из
+        лучших, половина стартового поколения которой -- лучшие особи
+        этой популяции.
+
+        :return: Список пар (номер замененной популяции, номер лучшей)
+        """
+
+        scores = []
+        for number, summary in enumerate(summaries):
+            best_cost, cpu_time = self.schedule_marks[number]
+            spent = summary["cpu_time"] - cpu_time
+            gain = summary["best_cost"] - best_cost
+            scores.append((gain / spent if spent > 0 else 0.,
+                           summary["best_cost"]))
+            self.schedule_marks[number] = (summary["best_cost"],
+                                           summary["cpu_time"])
+
+        order = sorted(range(self.n_populations),
+                       key=lambda number: scores[number], reverse=True)
+        n_replaced = int(self.schedule_fraction * self.n_populations)
+        n_replaced = min(max(n_replaced, 1), self.n_populations // 2)
+        replaced = []
+        for loser in order[self.n_populations - n_replaced:]:
+            winner = order[self.rng.integers(n_replaced)]
+            params = self.perturb_params(self.populations_params[winner])
+            self.populations[winner].send("elite", params["max_specimen"] // 2)
+            item_counts = self.populations[winner].recv()
+
+            self.populations[loser].close()
+            self.populations[loser] = self.create_population(params,
+                                                             item_counts)
+            self.populations_params[loser] = params
+            self.schedule_marks[loser] = (summaries[winner]["best_cost"], 0.)
+            replaced.append((loser, winner))
+        return replaced
+
+    def call_populations(self, method, *args):
+        """Вызывает метод у всех популяций одновременно и ждет результатов."""
+
+        for population in self.populations:
+            population.send(method, *args)
+        return [population.recv() for population in self.populations]
+
+    def get_neighbours(self, population_number):
+        """Возвращает номера популяций, в которые отправляются мигранты."""
+
+        n_populations = self.n_populations
+        if self.migration_topology == "ring":
+            return [(population_number + 1) % n_populations]
+        if self.migration_topology == "star" and population_number != 0:
+            return [0]
+        return [number for number in range(n_populations)
+                if number != population_number]
 
     def migrate(self):
-        for population_number, population in enumerate(self.populations):
-            for backpack_number, backpack in enumerate(
-                    population.cur_generation):
-                if random.random() < self.migration_proba:
-                    r = [
-                        number for number in range(
-                            self.n_populations) if number != population_number]
-                    target_population = random.choice(r)
-                    self.populations[target_population].cur_generation.append(
-                        backpack)
-                    self.populations[population_number].cur_generation.pop(
-                        backpack_number)
+        """
+        Проводит миграцию между популяциями.
+
+        Каждая популяция отбирает мигрантов за один розыгрыш и отправляет
+        их копии по топологии migration_topology; прибывшие мигранты
+        заменяют особей по migration_policy, так что размеры популяций
+        не меняются. Между процессами передаются только геномы мигрантов.
+        """
+
+        emigrants = self.call_populations("emigrate", self.migration_proba)
+        arrivals = [[] for _ in self.populations]
+        for population_number, item_counts in enumerate(emigrants):
+            if self.n_populations < 2 or not item_counts:
+                continue
+            if self.migration_topology == "random":
+                targets = self.rng.integers(0, self.n_populations - 1,
+                                            len(item_counts))
+                targets[targets >= population_number] += 1
+                for target_population, counts in zip(targets.tolist(),
+                                                      item_counts):
+                    arrivals[target_population].append(counts)
+            else:
+                for target_population in self.get_neighbours(population_number):
+                    arrivals[target_population].extend(item_counts)
+
+        for population, item_counts in zip(self.populations, arrivals):
+            population.send("immigrate", item_counts, self.migration_policy)
+        return [population.recv() for population in self.populations]
 
     def evolve(self):
-        def func(x): return x.evolve(max_generations=self.migration_delay)
+        """
+        Запускает процесс эволюции популяций с миграциями.
+
+        Эволюция останавливается по первому сработавшему критерию,
+        его название сохраняется в stop_reason. Лучшая особь всех
+        популяций хранится в best_backpack.
+        """
+
+        start_time = time.perf_counter()
+        stagnation = 0
+        self.stop_reason = "n_migrations"
         avg_fitness = 0
         for i in range(self.n_migrations):
-            list(map(func, self.populations))
-            self.migrate()
-            print(
-                f"Миграция {i+1}")
-            new_avg_fitness = sum(population.cur_generation.cost
-                                  for population in self.populations) / self.n_populations
-            print(
-                f"Среднее значение функции приспособленности: {new_avg_fitness}")
-            print("Первая популяция:")
-            self.populations[0].get_info()
-            if abs(new_avg_fitness - avg_fitness) < self.epsilon:
+            time_budget = None
+            if self.time_budget is not None:
+                time_budget = max(
+                    self.time_budget - (time.perf_counter() - start_time), 0)
+                if not self.parallel:
+                    # локальные популяции развиваются по очереди
+                    time_budget /= self.n_populations
+
+            start = time.perf_counter()
+            summaries = self.call_populations(
+                "evolve", self.migration_delay, time_budget)
+            evolution_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            costs = self.migrate()
+            migration_time = time.perf_counter() - start
+
+            # популяции могут знать более точную оценку (см. solve_exact)
+            self.upper_bound = min(self.upper_bound,
+                                   *(summary["upper_bound"]
+                                     for summary in summaries))
+            best = max(summaries, key=lambda summary: summary["best_cost"])
+            if self.best_backpack is None or \
+                    best["best_cost"] > self.best_backpack.cost:
+                self.best_backpack = Backpack(self.items,
+                                              best["best_item_counts"])
+                stagnation = 0
+            else:
+                stagnation += 1
+
+            self.timings["evolution"] += evolution_time
+            self.timings["migration"] += migration_time
+            new_avg_fitness = sum(costs) / self.n_populations
+            for callback in self.callbacks:
+                callback({"event": "migration",
+                          "migration": i + 1,
+                          "cost": new_avg_fitness,
+                          "best_cost": self.best_backpack.cost,
+                          "summaries": summaries,
+                          "timings": {"evolution": evolution_time,
+                                      "migration": migration_time}})
+
+            if not self.quiet:
+                print(
+                    f"Миграция {i+1}")
+                print(
+                    f"Среднее значение функции приспособленности: {new_avg_fitness}")
+                print("Первая популяция:")
+                self.populations[0].send("get_info")
+                self.populations[0].recv()
+            if self.epsilon is not None and \
+                    abs(new_avg_fitness - avg_fitness) < self.epsilon:
+                self.stop_reason = "epsilon"
                 break
             avg_fitness = new_avg_fitness
-        print("В конце")
-        print(f"Среднее значение функции приспособленности: {new_avg_fitness}")
-        self.populations[0].get_info()
+
+            stop_reason = check_stop(self, self.best_backpack.cost, stagnation,
+                                     time.perf_counter() - start_time,
+                                     self.time_budget)
+            if stop_reason is not None:
+                self.stop_reason = stop_reason
+                break
+
+            if self.scheduler == "halving" and \
+                    (i + 1) % self.schedule_interval == 0 and \
+                    i + 1 < self.n_migrations:
+                replaced = self.schedule(summaries)
+                for callback in self.callbacks:
+                    callback({"event": "schedule",
+                              "migration": i + 1,
+                              "replaced": replaced,
+                              "populations_params": self.populations_params})
+                if not self.quiet:
+                    for loser, winner in replaced:
+                        print(f"Популяция {loser+1} заменена потомком "
+                              f"популяции {winner+1}")
+        if self.best_backpack is None:
+            # миграций не было (n_migrations=0): лучшая особь стартовых
+            # поколений, как у BackpackFactory с max_generations=0
+            summaries = self.call_populations("evolve", 0)
+            best = max(summaries, key=lambda summary: summary["best_cost"])
+            self.best_backpack = Backpack(self.items, best["best_item_counts"])
+            new_avg_fitness = sum(summary["cost"]
+                                  for summary in summaries) / self.n_populations
+        if not self.quiet:
+            print("В конце")
+            print(f"Среднее значение функции приспособленности: {new_avg_fitness}")
+            print(f"Лучшая особь: {self.restore(self.best_backpack)}")
+            print(f"Причина остановки: {self.stop_reason}")
+            self.populations[0].send("get_info")
+            self.populations[0].recv()
+
+    def solve(self):
+        """
+        Запускает эволюцию и возвращает лучшую найденную особь
+        для исходного списка предметов.
+        """
+
+        self.evolve()
+        return self.restore(self.best_backpack)
+
+    def restore(self, backpack):
+        """Возвращает особь для исходного списка предметов."""
+
+        return restore_backpack(self.all_items, self.item_numbers, backpack)
+
+    def get_params(self):
+        """Возвращает параметры, с которыми создан запускатель."""
+
+        return {"max_volume": self.max_volume,
+                "n_populations": self.n_populations,
+                "populations_params": self.populations_params,
+                "migration_delay": self.migration_delay,
+                "migration_proba": self.migration_proba,
+                "n_migrations": self.n_migrations,
+                "scheduler": self.scheduler,
+                "schedule_interval": self.schedule_interval,
+                "schedule_fraction": self.schedule_fraction,
+                "epsilon": self.epsilon,
+                "time_budget": self.time_budget,
+                "patience": self.patience,
+                "target_cost": self.target_cost,
+                "preprocess": self.preprocess,
+                "exact_threshold": self.exact_threshold,
+                "exact_seeds": self.exact_seeds,
+                "max_resources": self.max_resources,
+                "engine": self.engine,
+                "migration_topology": self.migration_topology,
+                "migration_policy": self.migration_policy}
+
+    def save(self, path):
+        """
+        Сохраняет состояние всех популяций в файл .npz (см.
+        BackpackFactory.save). Состояние популяции i хранится
+        с префиксом "island<i>_".
+        """
+
+        state = items_state(self.all_items)
+        # предметы хранятся один раз, без копий в состояниях популяций
+        item_keys = set(state)
+        state["params"] = np.array(json.dumps(self.get_params()))
+        state["rng_state"] = np.array(json.dumps(
+            {"bit_generator": self.rng.bit_generator.state,
+             "entropy": self.seed_sequence.entropy,
+             "spawn_key": self.seed_sequence.spawn_key,
+             "n_children_spawned": self.seed_sequence.n_children_spawned}))
+        if self.best_backpack is not None:
+            state["best_item_counts"] = np.array(self.best_backpack.item_counts)
+        for i, island_state in enumerate(self.call_populations("get_state")):
+            for key, value in island_state.items():
+                if key not in item_keys:
+                    state[f"island{i}_{key}"] = value
+        np.savez(path, **state)
+
+    @classmethod
+    def load(cls, path, **params):
+        """
+        Создает запускатель из файла, сохраненного save.
+
+        :param path: Путь к файлу
+        :param params: Параметры, не сохраняемые в файле (parallel,
+            shared_cache, quiet, callbacks), или заменяющие сохраненные
+        """
+
+        with np.load(path) as state:
+            state = dict(state)
+        params = dict(json.loads(state["params"].item()), **params)
+        launcher = cls(state_items(state), **params)
+        rng_state = json.loads(state["rng_state"].item())
+        launcher.seed_sequence = np.random.SeedSequence(
+            rng_state["entropy"],
+            spawn_key=rng_state["spawn_key"],
+            n_children_spawned=rng_state["n_children_spawned"])
+        launcher.rng.bit_generator.state = rng_state["bit_generator"]
+        if "best_item_counts" in state:
+            launcher.best_backpack = Backpack(
+                launcher.items, state["best_item_counts"].tolist())
+        for i, population in enumerate(launcher.populations):
+            prefix = f"island{i}_"
+            population.send("set_state",
+                            {key[len(prefix):]: value
+                             for key, value in state.items()
+                             if key.startswith(prefix)})
+            population.recv()
+        return launcher
+
+    def retarget(self, items=None, max_volume=None):
+        """
+        Переводит все популяции на измененные предметы или объем рюкзака
+        (см. BackpackFactory.retarget).
+        """
+
+        self.set_items(self.all_items if items is None else items,
+                       self.max_volume if max_volume is None else max_volume)
+        self.best_backpack = None
+        self.stop_reason = None
+        items, item_numbers = self.island_items()
+        self.call_populations("retarget", items, self.max_volume, item_numbers)
+
+    def close(self):
+        """Останавливает процессы популяций."""
+
+        for population in self.populations:
+            population.close()
+
+
+class LocalIsland:
+    """
+    Популяция, развивающаяся в текущем процессе.
+
+    Команды передаются через send/recv так же, как и ProcessIsland,
+    поэтому запускающий их код не зависит от способа запуска.
+
+    :param factory_params: Параметры BackpackFactory
+    """
+
+    def __init__(self, **factory_params):
+        self.factory = BackpackFactory(**factory_params)
+        self.result = None
+        self.cpu_time = 0.  # процессорное время эволюции популяции
+
+    def send(self, method, *args):
+        self.result = getattr(self, method)(*args)
+
+    def recv(self):
+        return self.result
+
+    def close(self):
+        pass
+
+    def get_state(self):
+        return self.factory.get_state()
+
+    def set_state(self, state):
+        self.factory.set_state(state)
+
+    def retarget(self, items, max_volume, item_numbers=None):
+        self.factory.retarget(items, max_volume, item_numbers)
+
+    def evolve(self, max_generations, time_budget=None):
+        """Развивает популяцию и возвращает сведения о ней (см. summary)."""
+
+        start = time.process_time()
+        self.factory.evolve(max_generations=max_generations,
+                            time_budget=time_budget)
+        self.cpu_time += time.process_time() - start
+        return self.summary()
+
+    def elite(self, n_specimen):
+        """Возвращает геномы n_specimen лучших особей."""
+
+        generation = self.factory.cur_generation
+        best = top_indices(generation.costs,
+                           min(n_specimen, len(generation))).tolist()
+        return [generation[number].item_counts for number in best]
+
+    def emigrate(self, migration_proba):
+        """Отбирает случайных мигрантов и возвращает их геномы."""
+
+        generation = self.factory.cur_generation
+        rng = self.factory.rng
+        n_emigrants = rng.binomial(len(generation), migration_proba)
+        emigrants = rng.choice(len(generation), n_emigrants,
+                               replace=False).tolist()
+        return [generation[number].item_counts for number in emigrants]
+
+    def immigrate(self, item_counts, migration_policy="replace_worst"):
+        """
+        Заменяет особей популяции мигрантами и возвращает ее
+        приспособленность.
+        """
+
+        generation = self.factory.cur_generation
+        item_counts = item_counts[:len(generation)]
+        if migration_policy == "replace_worst":
+            targets = top_indices(-generation.costs, len(item_counts)).tolist()
+        else:
+            targets = self.factory.rng.choice(len(generation), len(item_counts),
+                                              replace=False).tolist()
+
+        for number, counts in zip(targets, item_counts):
+            backpack = self.factory.create_backpack(counts)
+            generation[number] = backpack
+            self.factory.update_best(backpack)
+        return generation.cost
+
+    def summary(self):
+        """Возвращает краткие сведения о состоянии популяции."""
+
+        factory = self.factory
+        return {"size": len(factory.cur_generation),
+                "cost": factory.cur_generation.cost,
+                "best_cost": factory.best_backpack.cost,
+                "best_item_counts": factory.best_backpack.item_counts,
+                "epochs_evolved": factory.epochs_evolved,
+                "stop_reason": factory.stop_reason,
+                "upper_bound": factory.upper_bound,
+                "cpu_time": self.cpu_time,
+                "counters": dict(factory.counters),
+                "timings": dict(factory.timings)}
+
+    def get_info(self):
+        self.factory.get_info()
+
+    def print_hyperparams(self):
+        self.factory.print_hyperparams()
+
+
+class ProcessIsland:
+    """
+    Популяция, развивающаяся в отдельном процессе.
+
+    Процесс живет до вызова close, популяция хранится в нем
+    и не передается между процессами.
+
+    :param factory_params: Параметры BackpackFactory
+    """
+
+    def __init__(self, **factory_params):
+        self.connection, worker_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=run_island,
+            args=(worker_connection, factory_params),
+            daemon=True)
+        self.process.start()
+        worker_connection.close()
+
+    def send(self, method, *args):
+        self.connection.send((method, args))
+
+    def recv(self):
+        result = self.connection.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        if self.process.is_alive():
+            self.connection.send((None, ()))
+            self.process.join()
+        self.connection.close()
+
+
+def run_island(connection, factory_params):
+    """Цикл обработки команд популяции в отдельном процессе."""
+
+    island = LocalIsland(**factory_params)
+    sys.stdout.flush()
+    while True:
+        method, args = connection.recv()
+        if method is None:
+            break
+        try:
+            result = getattr(island, method)(*args)
+        except Exception as e:
+            result = e
+        sys.stdout.flush()
+        connection.send(result)
+    connection.close()
 
 
 class BackpackFactory:
@@ -130,9 +751,66 @@ class BackpackFactory:
         Avg -- среднее между родителями
     :param crossover_probability: Вероятность кроссовера
     :param mutation_probability: Вероятность мутации
-    :param epsilon: Точность функции приспособленности
+    :param epsilon: Точность функции приспособленности (если None, то
+        средняя приспособленность не проверяется)
+    :param mutation_type: Тип мутации.
+        Random -- потомок заменяется новой случайной особью
+        Point -- в лучшем из родителей изменяется один предмет: добавляется
+        или выкладывается одна штука, одна штука меняется на другой
+        предмет или оставшийся объем заполняется случайным предметом.
+        Стоимость и объем потомка вычисляются по изменению
+    :param time_budget: Ограничение времени одного запуска evolve в секундах
+    :param patience: Максимальное количество поколений без улучшения
+        лучшей особи
+    :param target_cost: Стоимость, при достижении которой эволюция
+        останавливается
+    :param preprocess: Исключить из генома не помещающиеся и доминируемые
+        предметы (см. reduce_items). Особи состоят из количеств оставшихся
+        предметов, restore возвращает особь для исходного списка
+    :param item_numbers: Позиции предметов генома в items, уже найденные
+        (например, запускателем), вместо preprocess
+    :param exact_threshold: Если произведение количества типов предметов
+        на объем рюкзака не больше exact_threshold и объемы целые, то
+        оптимум находится динамическим программированием и попадает в
+        стартовое поколение, эволюция сразу останавливается (None -- не
+        использовать)
+    :param exact_seeds: Количество решений динамического
+        программирования в стартовом поколении. Для больших задач решения
+        ищутся по укрупненным объемам и близки к оптимальным
+    :param initial_item_counts: Геномы допустимых особей, добавляемых в
+        стартовое поколение (например, лучших особей другой популяции)
+    :param max_resources: Ограничения дополнительных ресурсов (вес и т.п.),
+        расход которых задан в Item.resources. Если заданы или количества
+        предметов ограничены (Item.max_count), то все ограничения
+        проверяются для всех потомков сразу матричной операцией (см.
+        batch_feasible), а случайные особи, исправление и заполнение
+        соблюдают все ограничения. Динамическое программирование и
+        исключение доминируемых предметов при этом не используются
+    :param engine: Представление популяции.
+        Python -- список объектов Backpack
+        Numpy -- матрица количеств (особи × типы предметов)
+    :param repair_fill: Заполнять объем, освободившийся после исправления
+        недопустимой особи, предметами с лучшей удельной стоимостью
+    :param selection_type: Тип отбора родителей.
+        Uniform -- случайная пара различных особей
+        Tournament -- лучшая из tournament_size случайных особей
+        Roulette -- вероятность пропорциональна приспособленности
+    :param tournament_size: Размер турнира
+    :param evaluation_cache: Кэш вычислений особей (если None, то создается
+        свой). Используется движком python
+    :param cache_size: Размер создаваемого кэша вычислений в элементах
+        геномов (количество особей × количество типов предметов)
+    :param seed: Зерно генератора случайных чисел фабрики (int,
+        np.random.SeedSequence или None -- случайное)
+    :param quiet: Не выводить параметры при создании
+    :param callbacks: Функции callback(event), получающие события
+        "initialization" и "generation" с временами этапов и счетчиками
     """
 
+    # методы, заменяемые при нескольких ограничениях (см. set_constraints)
+    CONSTRAINED_METHODS = ("create_rand_item_counts", "repair", "item_fits",
+                           "batch_item_fits", "batch_repair", "batch_fill")
+
     def __init__(self,
                  items,
                  max_volume=50,
@@ -142,13 +820,41 @@ class BackpackFactory:
                  crossover_type="avg",
                  crossover_probability=.85,
                  mutation_probability=.1,
-                 epsilon=.001):
+                 epsilon=.001,
+                 *,
+                 mutation_type="random",
+                 time_budget=None,
+                 patience=None,
+                 target_cost=None,
+                 preprocess=True,
+                 item_numbers=None,
+                 exact_threshold=10 ** 6,
+                 exact_seeds=0,
+                 initial_item_counts=None,
+                 max_resources=None,
+                 engine="python",
+                 repair_fill=False,
+                 selection_type="uniform",
+                 tournament_size=3,
+                 evaluation_cache=None,
+                 cache_size=10 ** 7,
+                 seed=None,
+                 quiet=False,
+                 callbacks=None):
 
         assert crossover_type in ("rand", "avg"), "Invalid crossover type"
-
-        self.items = items  # List of Item
-        self.types_count = len(items)
-        self.max_volume = max_volume
+        assert mutation_type in ("random", "point"), "Invalid mutation type"
+        assert engine in ("python", "numpy"), "Invalid engine"
+        assert selection_type in ("uniform", "tournament", "roulette"), \
+            "Invalid selection type"
+
+        # все случайные величины фабрики берутся из своего генератора
+        self.rng = np.random.default_rng(seed)
+        self.preprocess = preprocess
+        self.exact_threshold = exact_threshold
+        self.max_resources = None if max_resources is None \
+            else np.asarray(max_resources).tolist()
+        self.set_items(items, max_volume, item_numbers)
         self.alpha = alpha
         self.max_generations = max_generations
         self.max_specimen = max_specimen
@@ -159,108 +865,828 @@ class BackpackFactory:
             self.crossover = self.avg_crossover
         self.crossover_probability = crossover_probability
         self.mutation_probability = mutation_probability
+        self.mutation_type = mutation_type
         self.epsilon = epsilon
+        self.time_budget = time_budget
+        self.patience = patience
+        self.target_cost = target_cost
+        self.exact_seeds = exact_seeds
+        self.initial_item_counts = initial_item_counts or []
+        self.selection_type = selection_type
+        self.tournament_size = tournament_size
+        if selection_type == "uniform":
+            self.select_parents = self.uniform_selection
+        elif selection_type == "tournament":
+            self.select_parents = self.tournament_selection
+        else:
+            self.select_parents = self.roulette_selection
+        self.engine = engine
+        if evaluation_cache is None:
+            evaluation_cache = EvaluationCache(cache_size)
+        self.evaluation_cache = evaluation_cache
+        self.repair_fill = repair_fill
+        if engine == "numpy":
+            self.create_start_generation = self.create_start_matrix_generation
+            self.create_new_generation = self.create_new_matrix_generation
 
         self.cur_generation = None
+        self.best_backpack = None  # лучшая особь за все время эволюции
+        self.stagnation = 0  # поколений подряд без улучшения лучшей особи
+        self.stop_reason = None
         self.epochs_evolved = 0
-        self.print_hyperparams()
-
-    def create_rand_backpack(self):
-        """Создает случайную допустимую особь."""
-
-        backpack_volume = 0
-        available_items = self.items
-        item_counts = [0] * self.types_count  # изначально особь пустая
-        while len(available_items) != 0:
-            available_items = list(
-                filter(
-                    lambda x: x.volume <= self.max_volume -
-                    backpack_volume,
-                    available_items))
-            if len(available_items) == 0:
-                break
-            item = random.choice(available_items)  # выбираем случайный предмет
-
-            # выбираем случайное количество предмета
-            if len(available_items) == 1:
-                item_count = int(
-                    (self.max_volume - backpack_volume) / item.volume)
+        self.callbacks = callbacks or []
+        # суммарные времена этапов эволюции в секундах
+        self.timings = dict.fromkeys(("initialization", "selection",
+                                      "crossover", "mutation", "evaluation",
+                                      "repair"), 0.)
+        self.counters = {"evaluations": 0,  # вычислений стоимости особей
+                         "repairs": 0,  # исправленных особей
+                         "infeasible": 0}  # недопустимых потомков кроссовера
+        if not quiet:
+            self.print_hyperparams()
+
+    def set_items(self, items, max_volume, item_numbers=None):
+        """
+        Задает предметы и объем рюкзака и вычисляет зависящие от них
+        величины.
+
+        :param item_numbers: Позиции предметов генома (если None, то по
+            preprocess)
+        """
+
+        self.all_items = items  # исходный список предметов или ItemCatalog
+        if item_numbers is not None:
+            self.item_numbers = np.asarray(item_numbers).tolist()
+            items = select_items(items, self.item_numbers)
+        elif self.preprocess:
+            # позиции оставшихся предметов в исходном списке
+            self.item_numbers = reduce_items(items, max_volume,
+                                             self.max_resources)
+            items = select_items(items, self.item_numbers)
+        else:
+            self.item_numbers = list(range(len(items)))
+        self.items = items  # List of Item или ItemCatalog
+        self.types_count = len(items)
+        self.max_volume = max_volume
+        # оценка сверху: рюкзак, заполненный лучшим по удельной стоимости
+        # предметом без остатка
+        self.upper_bound = get_upper_bound(items, max_volume,
+                                           self.max_resources)
+        # векторы стоимостей и объемов для вычисления по всей популяции сразу
+        _, self.item_volumes, self.item_costs = item_columns(items)
+        # объемы и стоимости списками: поэлементный доступ в python-движке
+        # не создает Item из столбцов ItemCatalog
+        self.volume_list = self.item_volumes.tolist()
+        self.cost_list = self.item_costs.tolist()
+        self.integer_volumes = self.item_volumes.dtype.kind in "iu"
+        resources, max_counts = item_limits(items)
+        self.constrained = self.max_resources is not None or \
+            bool((max_counts != UNLIMITED).any())
+        self.exact = not self.constrained and self.integer_volumes and \
+            self.exact_threshold is not None and \
+            self.types_count * max_volume <= self.exact_threshold
+        # номера предметов по возрастанию стоимости единицы объема
+        self.ratio_order = np.argsort(self.item_costs / self.item_volumes,
+                                      kind="stable").tolist()
+        # предметы по возрастанию объема: помещающиеся в оставшийся объем
+        # предметы образуют префикс и находятся бисекцией
+        volume_order = np.argsort(self.item_volumes, kind="stable")
+        self.volume_order = volume_order.tolist()
+        self.sorted_volumes = self.item_volumes[volume_order].tolist()
+
+        for name in self.CONSTRAINED_METHODS:
+            self.__dict__.pop(name, None)
+        if self.constrained:
+            self.set_constraints(resources, max_counts)
+
+    def set_constraints(self, resources, max_counts):
+        """
+        Задает матрицу расхода ресурсов и ограничения количеств и
+        подключает методы, соблюдающие все ограничения (с префиксом
+        constrained_).
+
+        :param resources: Расход дополнительных ресурсов (предметы × ресурсы)
+        :param max_counts: Ограничения количеств предметов
+        """
+
+        max_resources = self.max_resources or []
+        if self.max_resources is None:
+            resources = resources[:, :0]
+        assert resources.shape[1] == len(max_resources), \
+            "Item resources don't match max_resources"
+        # столбец 0 -- объем, остальные -- дополнительные ресурсы
+        self.item_weights = np.column_stack([self.item_volumes, resources])
+        self.capacities = np.array([self.max_volume, *max_resources])
+        # больше штук предмета не разрешено или не помещается в пустой рюкзак
+        self.item_bounds = np.minimum(
+            max_counts,
+            self.count_fits(self.capacities, self.item_weights, UNLIMITED))
+        # удельная стоимость -- по сумме долей ограничений, занимаемых
+        # одной штукой предмета
+        self.ratio_order = np.argsort(
+            self.item_costs / (self.item_weights / self.capacities).sum(axis=1),
+            kind="stable").tolist()
+        for name in self.CONSTRAINED_METHODS:
+            setattr(self, name, getattr(self, f"constrained_{name}"))
+
+    @staticmethod
+    def count_fits(free, weights, room):
+        """
+        Возвращает, сколько штук предмета еще можно добавить.
+
+        :param free: Свободные ресурсы (..., ресурсы)
+        :param weights: Расход ресурсов одной штукой (..., ресурсы)
+        :param room: Сколько штук разрешает ограничение количества (...)
+        """
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fits = np.where(weights > 0, free // weights, np.inf).min(axis=-1)
+        return np.maximum(np.minimum(fits, room), 0).astype(np.int64)
+
+    def batch_feasible(self, item_counts):
+        """Проверяет все ограничения для строк матрицы количеств сразу."""
+
+        if not self.constrained:
+            return item_counts @ self.item_volumes <= self.max_volume
+        return ((item_counts @ self.item_weights <= self.capacities).all(axis=1)
+                & (item_counts <= self.item_bounds).all(axis=1))
+
+    def retarget(self, items=None, max_volume=None, item_numbers=None):
+        """
+        Переводит фабрику на измененные предметы или объем рюкзака.
+
+        Текущее поколение сохраняется: количества переносятся по
+        Item.number (предметов, которых больше нет, выкладываются),
+        недопустимые особи исправляются (см. batch_repair), свободный
+        объем заполняется (см. batch_fill). Кэш
+        вычислений очищается, лучшая особь выбирается заново, и
+        эволюция продолжается вызовом evolve с текущего поколения.
+
+        :param items: Новый список предметов (если None, то прежний)
+        :param max_volume: Новый объем рюкзака (если None, то прежний)
+        :param item_numbers: Позиции предметов генома в items (если None,
+            то находятся заново по preprocess)
+        """
+
+        generation = self.cur_generation
+        if generation is not None:
+            # количества в позициях исходного списка
+            old_numbers = item_columns(
+                self.all_items)[0][self.item_numbers].tolist()
+            if self.engine == "numpy":
+                old_counts = generation.item_counts
             else:
-                item_count = random.randint(
-                    1, (self.max_volume - backpack_volume) // item.volume)
+                old_counts = np.array([backpack.item_counts
+                                       for backpack in generation])
+
+        self.set_items(self.all_items if items is None else items,
+                       self.max_volume if max_volume is None else max_volume,
+                       item_numbers)
+        self.evaluation_cache.clear()
+        self.best_backpack = None
+        self.stagnation = 0
+        self.stop_reason = None
+        if generation is None:
+            return
+
+        columns = {number: column for column, number in enumerate(old_numbers)}
+        item_counts = np.zeros((len(old_counts), self.types_count),
+                               dtype=np.int64)
+        for column, number in enumerate(item_columns(self.items)[0].tolist()):
+            if number in columns:
+                item_counts[:, column] = old_counts[:, columns[number]]
+        item_counts = self.batch_fill(self.batch_repair(item_counts))
+        if self.exact:
+            backpack = solve_exact(self.items, self.max_volume)[0]
+            self.upper_bound = backpack.cost
+            item_counts[0] = backpack.item_counts
+
+        if self.engine == "numpy":
+            generation = MatrixGeneration(self.items, item_counts,
+                                          *self.evaluate(item_counts))
+            self.update_best(generation[generation.costs.argmax()])
+        else:
+            generation = Generation([self.create_backpack(counts)
+                                     for counts in item_counts.tolist()])
+            self.update_best(max(generation, key=lambda x: x.cost))
+        self.cur_generation = generation
+
+    def create_rand_item_counts(self, n_specimen):
+        """
+        Создает матрицу количеств из n_specimen случайных допустимых особей.
+
+        В особь добавляется случайное количество случайного помещающегося
+        предмета, пока помещается хотя бы один предмет. Каждый шаг
+        выполняется сразу для всех еще не заполненных особей.
+        """
+
+        volume_order = np.array(self.volume_order, dtype=np.int64)
+        sorted_volumes = np.array(self.sorted_volumes)
+        item_counts = np.zeros((n_specimen, self.types_count), dtype=np.int64)
+        free_volumes = np.full(n_specimen, self.max_volume,
+                               dtype=np.result_type(self.item_volumes,
+                                                    self.max_volume))
+        rows = np.arange(n_specimen)
+        while len(rows) != 0:
+            available = np.searchsorted(sorted_volumes, free_volumes[rows],
+                                        side="right")
+            rows, available = rows[available != 0], available[available != 0]
+            if len(rows) == 0:
+                break
 
-            # добавляем количества предмета на соответствующую позицию
-            item_counts[item.number] += item_count
-            # увеличиваем текущую вместимость особи
-            backpack_volume += item_count * item.volume
+            numbers = volume_order[
+                (self.rng.random(len(rows)) * available).astype(np.int64)]
+            volumes = self.item_volumes[numbers]
+            max_counts = (free_volumes[rows] // volumes).astype(np.int64)
+            counts = np.where(
+                available == 1,
+                max_counts,
+                1 + (self.rng.random(len(rows)) * max_counts).astype(np.int64))
+
+            item_counts[rows, numbers] += counts
+            free_volumes[rows] -= counts * volumes
+
+        return item_counts
+
+    def constrained_create_rand_item_counts(self, n_specimen):
+        """
+        Создает матрицу количеств из n_specimen случайных особей,
+        допустимых по всем ограничениям (см. create_rand_item_counts).
+
+        На каждом шаге для всех незаполненных особей сразу вычисляется,
+        сколько штук каждого предмета еще помещается.
+        """
+
+        item_counts = np.zeros((n_specimen, self.types_count), dtype=np.int64)
+        usage = np.zeros((n_specimen, len(self.capacities)),
+                         dtype=self.item_weights.dtype)
+        rows = np.arange(n_specimen)
+        while len(rows) != 0:
+            fits = self.count_fits((self.capacities - usage[rows])[:, None],
+                                   self.item_weights,
+                                   self.item_bounds - item_counts[rows])
+            available = fits > 0
+            n_available = available.sum(axis=1)
+            keep = n_available != 0
+            rows, fits, available, n_available = (
+                rows[keep], fits[keep], available[keep], n_available[keep])
+            if len(rows) == 0:
+                break
 
-        return Backpack(self.items, item_counts)
+            # случайный из помещающихся предметов: их числа больше 1
+            numbers = (self.rng.random(available.shape)
+                       + available).argmax(axis=1)
+            max_counts = fits[np.arange(len(rows)), numbers]
+            counts = np.where(
+                n_available == 1,
+                max_counts,
+                1 + (self.rng.random(len(rows)) * max_counts).astype(np.int64))
+
+            item_counts[rows, numbers] += counts
+            usage[rows] += counts[:, None] * self.item_weights[numbers]
+
+        return item_counts
+
+    def create_start_item_counts(self):
+        """
+        Создает матрицу количеств стартового поколения.
+
+        Первые особи -- решения динамического программирования (см.
+        solve_exact), если задача достаточно мала или задан exact_seeds,
+        и initial_item_counts, остальные случайные.
+        """
+
+        item_counts = self.create_rand_item_counts(self.max_specimen)
+        n_seeds = min(self.exact_seeds, self.max_specimen) \
+            if self.integer_volumes and not self.constrained else 0
+        backpacks = []
+        if self.exact:
+            backpacks = solve_exact(self.items, self.max_volume,
+                                    max(n_seeds, 1))
+            # оптимум найден, эволюция остановится по upper_bound
+            self.upper_bound = backpacks[0].cost
+        elif n_seeds:
+            # точное решение слишком дорого: объемы укрупняются так, чтобы
+            # таблица содержала не больше exact_threshold ячеек
+            scale = 1
+            if self.exact_threshold:
+                scale = -(-self.types_count * self.max_volume //
+                          self.exact_threshold)
+            backpacks = solve_exact(self.items, self.max_volume, n_seeds,
+                                    scale)
+
+        seeds = [backpack.item_counts for backpack in backpacks]
+        seeds.extend(self.initial_item_counts)
+        for row, counts in enumerate(seeds[:self.max_specimen]):
+            item_counts[row] = counts
+        return item_counts
 
     def create_start_generation(self):
         """Создает стартовое поколение."""
 
-        backpacks = [self.create_rand_backpack()
-                     for _ in range(self.max_specimen)]
+        backpacks = [self.create_backpack(item_counts)
+                     for item_counts in self.create_start_item_counts().tolist()]
+        self.update_best(max(backpacks, key=lambda x: x.cost))
         return Generation(backpacks)
 
     def rand_crossover(self, parent_1, parent_2):
-        """Проводит случайный кроссовер (случайный выбор частей родителей)."""
+        """
+        Проводит случайный кроссовер (случайный выбор частей родителей).
 
-        for _ in range(10): 
-            crossover_counts = [random.choice([par1_arg, par2_arg])
-                                for par1_arg, par2_arg in zip(parent_1.item_counts,
-                                                              parent_2.item_counts)]
-            backpack = Backpack(self.items, crossover_counts)
-            if backpack.volume <= self.max_volume:
-                return backpack
+        Возвращает количества предметов потомка, потомок может быть
+        недопустимым.
+        """
 
-        return parent_1 if parent_1.cost > parent_2.cost else parent_2
+        # выбор родителя разыгрывается сразу для всех генов
+        mask = (self.rng.random(self.types_count) < .5).tolist()
+        return [par1_arg if first else par2_arg
+                for par1_arg, par2_arg, first in zip(parent_1.item_counts,
+                                                     parent_2.item_counts,
+                                                     mask)]
 
     def avg_crossover(self, parent_1, parent_2):
-        """Проводит avg кроссовер (Среднее частей родителей)."""
-        for _ in range(10):
-            crossover_counts = [
-                (par1_arg + par2_arg) // 2 for par1_arg,
-                par2_arg in zip(
-                    parent_1.item_counts,
-                    parent_2.item_counts)]
-            backpack = Backpack(self.items, crossover_counts)
-            if backpack.volume <= self.max_volume:
-                return backpack
-        return parent_1 if parent_1.cost > parent_2.cost else parent_2
+        """
+        Проводит avg кроссовер (Среднее частей родителей).
+
+        Возвращает количества предметов потомка, потомок может быть
+        недопустимым.
+        """
+
+        return [
+            (par1_arg + par2_arg) // 2 for par1_arg,
+            par2_arg in zip(
+                parent_1.item_counts,
+                parent_2.item_counts)]
+
+    def repair(self, backpack):
+        """
+        Исправляет недопустимую особь.
+
+        Выкладывает предметы, начиная с худших по стоимости единицы
+        объема, пока особь не поместится в рюкзак. При repair_fill
+        освободившийся объем заполняется лучшими предметами.
+        """
+
+        self.counters["repairs"] += 1
+        item_counts = list(backpack.item_counts)
+        volume = backpack.volume
+        for number in self.ratio_order:
+            if volume <= self.max_volume:
+                break
+            item_volume = self.volume_list[number]
+            # минимальное количество предмета, которое нужно выложить
+            removed = min(item_counts[number],
+                          int(-(-(volume - self.max_volume) // item_volume)))
+            item_counts[number] -= removed
+            volume -= removed * item_volume
 
-    def create_new_generation(self, generation):
-        """Создает новое поколение особей."""
-        new_backpacks = []
+        if self.repair_fill:
+            for number in reversed(self.ratio_order):
+                item_volume = self.volume_list[number]
+                added = int((self.max_volume - volume) // item_volume)
+                item_counts[number] += added
+                volume += added * item_volume
 
-        for _ in range(2 * self.max_specimen):
-            if random.random() <= self.mutation_probability:
-                mutated_backpack = self.create_rand_backpack()
-                new_backpacks.append(mutated_backpack)
-                continue
+        return self.create_backpack(item_counts)
 
-            parent_1, parent_2 = random.sample(list(generation), k=2)
+    def constrained_repair(self, backpack):
+        """Исправляет особь, недопустимую по любому из ограничений."""
 
-            if random.random() <= self.crossover_probability:
-                crossovered_backpack = self.crossover(parent_1, parent_2)
-                new_backpacks.append(crossovered_backpack)
-                continue
+        item_counts = np.array([backpack.item_counts], dtype=np.int64)
+        return self.create_backpack(self.batch_repair(item_counts)[0].tolist())
 
-            new_backpacks.append(
-                parent_1 if parent_1.cost > parent_2.cost else parent_2)
+    def create_new_generation(self, generation):
+        """Создает новое поколение особей."""
+        n_children = 2 * self.max_specimen
+        new_backpacks = []
+        crossover_pairs = []
+        mutation_parents = []
+
+        with self.timer("selection"):
+            costs = generation.costs
+            parents = self.select_parents(costs, n_children)
+            mutation = (self.rng.random(n_children)
+                        <= self.mutation_probability).tolist()
+            crossover = (self.rng.random(n_children)
+                         <= self.crossover_probability).tolist()
+
+            for parent_1, parent_2, mutated, crossed in zip(
+                    *(numbers.tolist() for numbers in parents),
+                    mutation, crossover):
+                parent_1, parent_2 = generation[parent_1], generation[parent_2]
+
+                if mutated:
+                    mutation_parents.append(
+                        parent_1 if parent_1.cost > parent_2.cost else parent_2)
+                    continue
+
+                if crossed:
+                    crossover_pairs.append((parent_1, parent_2))
+                    continue
+
+                new_backpacks.append(
+                    parent_1 if parent_1.cost > parent_2.cost else parent_2)
+
+        with self.timer("crossover"):
+            children_counts = [self.crossover(parent_1, parent_2)
+                               for parent_1, parent_2 in crossover_pairs]
+
+        with self.timer("mutation"):
+            if self.mutation_type == "point":
+                # потомки допустимы и уже вычислены, случайные величины
+                # разыгрываются сразу для всех мутаций
+                n_mutants = len(mutation_parents)
+                new_backpacks.extend(map(
+                    self.point_mutation,
+                    mutation_parents,
+                    self.rng.integers(0, 4, n_mutants).tolist(),
+                    self.rng.random(n_mutants).tolist(),
+                    self.rng.integers(0, self.types_count, n_mutants).tolist()))
+            else:
+                children_counts.extend(self.create_rand_item_counts(
+                    len(mutation_parents)).tolist())
+
+        with self.timer("evaluation"):
+            children = [self.create_backpack(item_counts)
+                        for item_counts in children_counts]
+
+        with self.timer("repair"):
+            if self.constrained:
+                # все ограничения проверяются для всех потомков сразу
+                feasible = self.batch_feasible(np.array(
+                    [child.item_counts for child in children],
+                    dtype=np.int64).reshape(len(children), self.types_count)
+                ).tolist()
+            else:
+                feasible = [child.volume <= self.max_volume
+                            for child in children]
+            for number, (child, is_feasible) in enumerate(zip(children,
+                                                               feasible)):
+                if not is_feasible:
+                    self.counters["infeasible"] += 1
+                    children[number] = self.repair(child)
+        new_backpacks.extend(children)
+
+        with self.timer("selection"):
+            new_backpacks.extend(generation[number] for number in
+                                 top_indices(costs, self.alpha).tolist())
+            new_costs = np.array([backpack.cost for backpack in new_backpacks])
+            self.update_best(new_backpacks[new_costs.argmax()])
+            new_backpacks = [new_backpacks[number] for number in
+                             top_indices(new_costs, self.max_specimen).tolist()]
+
+        return Generation(new_backpacks)
+
+    def point_mutation(self, backpack, operation, removed_draw, added_number):
+        """
+        Проводит точечную мутацию допустимой особи (см. mutation_type).
+
+        Стоимость и объем потомка вычисляются по изменению количеств,
+        потомок допустим.
+
+        :param backpack: Особь
+        :param operation: Номер операции от 0 до 3
+        :param removed_draw: Случайное число из [0, 1) для выбора
+            выкладываемого предмета
+        :param added_number: Номер добавляемого предмета
+        """
+
+        item_counts = list(backpack.item_counts)
+        cost, volume = backpack.cost, backpack.volume
+        # 0 -- добавить штуку, 1 -- выложить штуку, 2 -- заменить штуку,
+        # 3 -- заполнить оставшийся объем
+        if operation in (1, 2):
+            present = [number for number, count in enumerate(item_counts)
+                       if count]
+            if present:
+                number = present[int(removed_draw * len(present))]
+                item_counts[number] -= 1
+                cost -= self.cost_list[number]
+                volume -= self.volume_list[number]
+        if operation != 1:
+            number = added_number
+            fits = self.item_fits(item_counts, volume, number)
+            added = fits if operation == 3 else int(fits > 0)
+            item_counts[number] += added
+            cost += added * self.cost_list[number]
+            volume += added * self.volume_list[number]
+
+        return Backpack(self.items, item_counts, cost, volume)
+
+    def item_fits(self, item_counts, volume, number):
+        """Возвращает, сколько штук предмета number помещается в особь."""
+
+        return int((self.max_volume - volume) // self.volume_list[number])
+
+    def constrained_item_fits(self, item_counts, volume, number):
+        free = self.capacities - np.array(item_counts) @ self.item_weights
+        return int(self.count_fits(free, self.item_weights[number],
+                                   self.item_bounds[number]
+                                   - item_counts[number]))
+
+    def uniform_selection(self, costs, n_pairs):
+        """Выбирает n_pairs пар различных особей равновероятно."""
+
+        n_specimen = len(costs)
+        parents_1 = self.rng.integers(0, n_specimen, n_pairs)
+        parents_2 = (parents_1 + self.rng.integers(1, n_specimen, n_pairs)
+                     ) % n_specimen
+        return parents_1, parents_2
+
+    def tournament_selection(self, costs, n_pairs):
+        """Выбирает каждого родителя как лучшую из tournament_size особей."""
+
+        contestants = self.rng.integers(
+            0, len(costs), (2, n_pairs, self.tournament_size))
+        winners = costs[contestants].argmax(axis=2)
+        parents = np.take_along_axis(contestants, winners[..., None], axis=2)
+        return parents[0, :, 0], parents[1, :, 0]
+
+    def roulette_selection(self, costs, n_pairs):
+        """Выбирает родителей с вероятностью, пропорциональной стоимости."""
+
+        cumulative_costs = np.cumsum(costs)
+        if cumulative_costs[-1] <= 0:
+            return self.uniform_selection(costs, n_pairs)
+        parents = np.searchsorted(
+            cumulative_costs,
+            self.rng.random((2, n_pairs)) * cumulative_costs[-1],
+            side="right")
+        return parents[0], parents[1]
+
+    def update_best(self, backpack):
+        """Запоминает особь, если она лучше лучшей найденной."""
+
+        if self.best_backpack is None or backpack.cost > self.best_backpack.cost:
+            self.best_backpack = backpack
+            return True
+        return False
+
+    @contextmanager
+    def timer(self, phase):
+        """Добавляет время выполнения блока к времени этапа phase."""
+
+        start = time.perf_counter()
+        yield
+        self.timings[phase] += time.perf_counter() - start
+
+    def notify(self, event, **fields):
+        """Передает событие всем callbacks."""
+
+        fields["event"] = event
+        for callback in self.callbacks:
+            callback(fields)
+
+    def create_backpack(self, item_counts):
+        """Создает особь, беря ее стоимость и объем из кэша вычислений."""
+
+        item_counts = tuple(item_counts)
+        backpack = self.evaluation_cache.get(item_counts)
+        if backpack is None:
+            backpack = Backpack(self.items, item_counts)
+            self.counters["evaluations"] += 1
+            self.evaluation_cache.put(item_counts, backpack)
+        return backpack
+
+    def evaluate(self, item_counts):
+        """Вычисляет стоимости и объемы для матрицы количеств."""
+
+        self.counters["evaluations"] += len(item_counts)
+        return item_counts @ self.item_costs, item_counts @ self.item_volumes
+
+    def create_start_matrix_generation(self):
+        """Создает стартовое поколение в матричном представлении."""
+
+        item_counts = self.create_start_item_counts()
+        generation = MatrixGeneration(self.items, item_counts,
+                                      *self.evaluate(item_counts))
+        self.update_best(generation[generation.costs.argmax()])
+        return generation
 
-        alpha_best = sorted(
-            generation,
-            key=lambda x: x.cost,
-            reverse=True)[
-            :self.alpha]
-        new_backpacks.extend(alpha_best)
-        new_backpacks = sorted(
-            new_backpacks,
-            key=lambda x: x.cost,
-            reverse=True)
+    def create_new_matrix_generation(self, generation):
+        """
+        Создает новое поколение особей в матричном представлении.
+
+        Все потомки поколения строятся сразу: пары родителей, решения о
+        кроссовере и мутации разыгрываются одним вызовом на поколение.
+        """
+        counts = generation.item_counts
+        costs = generation.costs
+        n_children = 2 * self.max_specimen
+
+        with self.timer("selection"):
+            # первым в паре идет более приспособленный родитель
+            parents_1, parents_2 = self.select_parents(costs, n_children)
+            swap = costs[parents_2] > costs[parents_1]
+            parents_1, parents_2 = (np.where(swap, parents_2, parents_1),
+                                    np.where(swap, parents_1, parents_2))
+            children = counts[parents_1]
+            children_costs = costs[parents_1]
+            children_volumes = generation.volumes[parents_1]
+
+            mutation = self.rng.random(n_children) <= self.mutation_probability
+            crossover = ((self.rng.random(n_children)
+                          <= self.crossover_probability) & ~mutation)
+
+        with self.timer("crossover"):
+            crossover_children = self.batch_crossover(
+                counts[parents_1[crossover]], counts[parents_2[crossover]])
+
+        with self.timer("repair"):
+            repairs = self.counters["repairs"]
+            children[crossover] = self.batch_repair(crossover_children)
+            self.counters["infeasible"] += self.counters["repairs"] - repairs
+
+        with self.timer("mutation"):
+            if self.mutation_type == "point":
+                (children[mutation], children_costs[mutation],
+                 children_volumes[mutation]) = self.batch_point_mutation(
+                    children[mutation], children_costs[mutation],
+                    children_volumes[mutation])
+                evaluated = crossover
+            else:
+                children[mutation] = self.create_rand_item_counts(
+                    mutation.sum())
+                evaluated = crossover | mutation
+
+        with self.timer("evaluation"):
+            # остальные потомки -- копии родителей или мутанты, их
+            # стоимости и объемы уже известны
+            children_costs[evaluated], children_volumes[evaluated] = \
+                self.evaluate(children[evaluated])
+            alpha_best = top_indices(costs, self.alpha)
+            new_counts = np.vstack([children, counts[alpha_best]])
+            new_costs = np.concatenate([children_costs, costs[alpha_best]])
+            new_volumes = np.concatenate([children_volumes,
+                                          generation.volumes[alpha_best]])
+
+        with self.timer("selection"):
+            best = top_indices(new_costs, self.max_specimen)
+            generation = MatrixGeneration(self.items, new_counts[best],
+                                          new_costs[best], new_volumes[best])
+        self.update_best(generation[generation.costs.argmax()])
+        return generation
 
-        return Generation(new_backpacks[0:self.max_specimen])
+    def batch_crossover(self, parents_1, parents_2):
+        """
+        Проводит кроссовер над парами строк матриц количеств.
+
+        Потомки могут быть недопустимыми, их исправляет batch_repair.
+        """
+
+        if self.crossover_type == "avg":
+            return (parents_1 + parents_2) // 2
+
+        mask = self.rng.random(parents_1.shape) < .5
+        return np.where(mask, parents_1, parents_2)
+
+    def batch_point_mutation(self, item_counts, costs, volumes):
+        """
+        Проводит точечные мутации строк матрицы количеств (см.
+        point_mutation).
+
+        :return: Матрица количеств, стоимости и объемы потомков
+        """
+
+        n_specimen = len(item_counts)
+        rows = np.arange(n_specimen)
+        operations = self.rng.integers(0, 4, n_specimen)
+
+        # выкладываемая штука -- случайный предмет из имеющихся в особи
+        present = item_counts > 0
+        removed_numbers = (self.rng.random(item_counts.shape)
+                           * present).argmax(axis=1)
+        removed = ((operations == 1) | (operations == 2)) & present.any(axis=1)
+        item_counts[rows[removed], removed_numbers[removed]] -= 1
+        costs = costs - removed * self.item_costs[removed_numbers]
+        volumes = volumes - removed * self.item_volumes[removed_numbers]
+
+        added_numbers = self.rng.integers(0, self.types_count, n_specimen)
+        fits = self.batch_item_fits(item_counts, volumes, added_numbers)
+        added = np.where(operations == 3, fits, (operations != 1) & (fits > 0))
+        item_counts[rows, added_numbers] += added
+        costs = costs + added * self.item_costs[added_numbers]
+        volumes = volumes + added * self.item_volumes[added_numbers]
+
+        return item_counts, costs, volumes
+
+    def batch_item_fits(self, item_counts, volumes, numbers):
+        """
+        Возвращает, сколько штук предмета numbers[i] помещается в строку i
+        матрицы количеств.
+        """
+
+        return ((self.max_volume - volumes)
+                // self.item_volumes[numbers]).astype(np.int64)
+
+    def constrained_batch_item_fits(self, item_counts, volumes, numbers):
+        rows = np.arange(len(item_counts))
+        return self.count_fits(
+            self.capacities - item_counts @ self.item_weights,
+            self.item_weights[numbers],
+            self.item_bounds[numbers] - item_counts[rows, numbers])
+
+    def batch_repair(self, item_counts):
+        """
+        Исправляет недопустимые строки матрицы количеств (см. repair).
+
+        Предметы перебираются один раз для всех недопустимых особей сразу.
+        """
+
+        volumes = item_counts @ self.item_volumes
+        infeasible = np.flatnonzero(volumes > self.max_volume)
+        if len(infeasible) == 0:
+            return item_counts
+        self.counters["repairs"] += len(infeasible)
+
+        counts = item_counts[infeasible]
+        volumes = volumes[infeasible]
+        for number in self.ratio_order:
+            excess = volumes - self.max_volume
+            if excess.max() <= 0:
+                break
+            volume = self.item_volumes[number]
+            removed = np.minimum(counts[:, number],
+                                 np.maximum(-(-excess // volume), 0)
+                                 ).astype(np.int64)
+            counts[:, number] -= removed
+            volumes -= removed * volume
+
+        if self.repair_fill:
+            counts = self.batch_fill(counts, volumes)
+
+        item_counts[infeasible] = counts
+        return item_counts
+
+    def batch_fill(self, item_counts, volumes=None):
+        """
+        Заполняет свободный объем строк матрицы количеств предметами
+        с лучшей удельной стоимостью.
+        """
+
+        if volumes is None:
+            volumes = item_counts @ self.item_volumes
+        for number in reversed(self.ratio_order):
+            volume = self.item_volumes[number]
+            added = ((self.max_volume - volumes) // volume).astype(np.int64)
+            item_counts[:, number] += added
+            volumes = volumes + added * volume
+        return item_counts
+
+    def constrained_batch_repair(self, item_counts):
+        """
+        Исправляет строки матрицы количеств, недопустимые по любому из
+        ограничений (см. batch_repair).
+
+        Количества сначала урезаются до Item.max_count, затем предметы
+        выкладываются, начиная с худших по удельной стоимости, по
+        самому нарушенному ограничению, в котором участвует предмет.
+        """
+
+        infeasible = np.flatnonzero(~self.batch_feasible(item_counts))
+        if len(infeasible) == 0:
+            return item_counts
+        self.counters["repairs"] += len(infeasible)
+
+        counts = np.minimum(item_counts[infeasible], self.item_bounds)
+        usage = counts @ self.item_weights
+        for number in self.ratio_order:
+            excess = usage - self.capacities
+            if excess.max() <= 0:
+                break
+            weights = self.item_weights[number]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                needed = np.where(weights > 0, -(-excess // weights),
+                                  0).max(axis=1)
+            removed = np.minimum(counts[:, number],
+                                 np.maximum(needed, 0)).astype(np.int64)
+            counts[:, number] -= removed
+            usage = usage - removed[:, None] * weights
+
+        if self.repair_fill:
+            counts = self.batch_fill(counts, usage)
+
+        item_counts[infeasible] = counts
+        return item_counts
+
+    def constrained_batch_fill(self, item_counts, usage=None):
+        """
+        Заполняет строки матрицы количеств предметами с лучшей удельной
+        стоимостью по всем ограничениям (см. batch_fill).
+
+        :param usage: Расход ресурсов строк (если None, то вычисляется)
+        """
+
+        if usage is None:
+            usage = item_counts @ self.item_weights
+        for number in reversed(self.ratio_order):
+            weights = self.item_weights[number]
+            added = self.count_fits(self.capacities - usage, weights,
+                                    self.item_bounds[number]
+                                    - item_counts[:, number])
+            item_counts[:, number] += added
+            usage = usage + added[:, None] * weights
+        return item_counts
 
     def get_info(self):
         if self.cur_generation is None:
@@ -268,31 +1694,82 @@ class BackpackFactory:
         print(f"Прошло поколений {self.epochs_evolved}")
         print(
             f"Приспособленность текущего поколения {self.cur_generation.cost:.4f}")
-        print(
-            f"Лучшая особь: {sorted(self.cur_generation, key=lambda x: x.cost, reverse=True)[0]}\n")
+        print(f"Лучшая особь: {self.restore(self.best_backpack)}")
+        print(f"Кэш вычислений: попаданий {self.evaluation_cache.hits}, "
+              f"промахов {self.evaluation_cache.misses}\n")
+
+    def evolve(self, max_generations=None, verbose=False, time_budget=None):
+        """
+        Запускает процесс эволюции.
+
+        Эволюция останавливается по первому сработавшему критерию,
+        его название сохраняется в stop_reason.
 
-    def evolve(self, max_generations=None, verbose=False):
-        """Запускает процесс эволюции."""
+        :param max_generations: Количество поколений (по умолчанию
+            self.max_generations)
+        :param verbose: Выводить ход эволюции
+        :param time_budget: Ограничение времени в секундах (по умолчанию
+            self.time_budget)
+        """
 
+        start_time = time.perf_counter()
         max_generations = max_generations or self.max_generations
+        if time_budget is None:
+            time_budget = self.time_budget
+        self.stop_reason = "max_generations"
         if self.cur_generation is None:
-            generation = self.create_start_generation()
+            with self.timer("initialization"):
+                generation = self.create_start_generation()
+            self.cur_generation = generation
+            if self.callbacks:
+                self.notify("initialization",
+                            cost=generation.cost,
+                            best_cost=self.best_backpack.cost,
+                            timings={"initialization":
+                                     self.timings["initialization"]},
+                            counters=dict(self.counters))
         else:
             generation = self.cur_generation
 
         max_cost = generation.cost
 
         for i in range(1, max_generations + 1):
+            stop_reason = check_stop(self, self.best_backpack.cost,
+                                     self.stagnation,
+                                     time.perf_counter() - start_time,
+                                     time_budget)
+            if stop_reason is not None:
+                self.stop_reason = stop_reason
+                if verbose:
+                    print(f"Поколение {i} -- выход ({stop_reason})")
+                break
+
             self.epochs_evolved += 1
+            timings = dict(self.timings)
+            best_cost = self.best_backpack.cost
             new_generation = self.create_new_generation(generation)
             new_cost = new_generation.cost
+            if self.best_backpack.cost > best_cost:
+                self.stagnation = 0
+            else:
+                self.stagnation += 1
+            if self.callbacks:
+                self.notify("generation",
+                            generation=self.epochs_evolved,
+                            cost=new_cost,
+                            best_cost=self.best_backpack.cost,
+                            timings={phase: self.timings[phase] - timings[phase]
+                                     for phase in self.timings},
+                            counters=dict(self.counters))
 
             if i % 10 == 0:
                 if verbose:
                     print(
                         f"Приспособленность поколения {i}: {generation.cost:.4f}")
 
-            if abs(new_generation.cost - generation.cost) < self.epsilon:
+            if self.epsilon is not None and \
+                    abs(new_generation.cost - generation.cost) < self.epsilon:
+                self.stop_reason = "epsilon"
                 if verbose:
                     print(f"Поколение {i} -- выход")
                 break
@@ -308,15 +1785,411 @@ class BackpackFactory:
             print(f"Максимальное значение приспособленности: {max_cost:.4f}")
         return generation
 
+    def solve(self, time_budget=None):
+        """
+        Запускает эволюцию и возвращает лучшую найденную особь
+        для исходного списка предметов.
+        """
+
+        self.evolve(time_budget=time_budget)
+        return self.restore(self.best_backpack)
+
+    def restore(self, backpack):
+        """Возвращает особь для исходного списка предметов."""
+
+        return restore_backpack(self.all_items, self.item_numbers, backpack)
+
+    def get_params(self):
+        """Возвращает параметры, с которыми создана фабрика."""
+
+        return {"max_volume": self.max_volume,
+                "alpha": self.alpha,
+                "max_generations": self.max_generations,
+                "max_specimen": self.max_specimen,
+                "crossover_type": self.crossover_type,
+                "crossover_probability": self.crossover_probability,
+                "mutation_probability": self.mutation_probability,
+                "mutation_type": self.mutation_type,
+                "epsilon": self.epsilon,
+                "time_budget": self.time_budget,
+                "patience": self.patience,
+                "target_cost": self.target_cost,
+                "preprocess": self.preprocess,
+                "exact_threshold": self.exact_threshold,
+                "exact_seeds": self.exact_seeds,
+                "max_resources": self.max_resources,
+                "engine": self.engine,
+                "repair_fill": self.repair_fill,
+                "selection_type": self.selection_type,
+                "tournament_size": self.tournament_size,
+                "cache_size": self.evaluation_cache.maxsize}
+
+    def get_state(self):
+        """
+        Возвращает состояние эволюции словарем массивов numpy.
+
+        Состояние включает исходные предметы, позиции предметов генома,
+        параметры, матрицу количеств текущего поколения, лучшую особь,
+        счетчики и состояние генератора случайных чисел. Словари хранятся
+        строками JSON, поэтому файл загружается без pickle.
+        """
+
+        state = items_state(self.all_items)
+        state["item_positions"] = np.array(self.item_numbers, dtype=np.int64)
+        state["params"] = np.array(json.dumps(self.get_params()))
+        if self.cur_generation is not None:
+            if self.engine == "numpy":
+                state["item_counts"] = self.cur_generation.item_counts
+            else:
+                state["item_counts"] = np.array(
+                    [backpack.item_counts for backpack in self.cur_generation])
+            state["best_item_counts"] = np.array(self.best_backpack.item_counts)
+        state["rng_state"] = np.array(json.dumps(self.rng.bit_generator.state))
+        state["stats"] = np.array(json.dumps(
+            {"epochs_evolved": self.epochs_evolved,
+             "stagnation": self.stagnation,
+             "stop_reason": self.stop_reason,
+             "upper_bound": self.upper_bound,
+             "counters": self.counters,
+             "timings": self.timings}))
+
+        return state
+
+    def set_state(self, state):
+        """
+        Восстанавливает состояние эволюции, полученное get_state.
+
+        Предметы и параметры из state не используются, фабрика должна
+        быть создана с теми же предметами (см. load).
+        """
+
+        if "item_counts" in state:
+            item_counts = np.asarray(state["item_counts"], dtype=np.int64)
+            if self.engine == "numpy":
+                self.cur_generation = MatrixGeneration(
+                    self.items, item_counts, *self.evaluate(item_counts))
+            else:
+                self.cur_generation = Generation(
+                    [self.create_backpack(counts)
+                     for counts in item_counts.tolist()])
+            self.best_backpack = Backpack(self.items,
+                                          state["best_item_counts"].tolist())
+
+        stats = json.loads(state["stats"].item())
+        self.epochs_evolved = stats["epochs_evolved"]
+        self.stagnation = stats["stagnation"]
+        self.stop_reason = stats["stop_reason"]
+        self.upper_bound = stats["upper_bound"]
+        # восстановление поколения не считается вычислениями
+        self.counters = stats["counters"]
+        self.timings = stats["timings"]
+
+        self.rng.bit_generator.state = json.loads(state["rng_state"].item())
+
+    def save(self, path):
+        """
+        Сохраняет состояние эволюции в несжатый файл .npz (см. get_state).
+
+        Эволюцию можно продолжить после load с того же поколения.
+        """
+
+        np.savez(path, **self.get_state())
+
+    @classmethod
+    def load(cls, path, **params):
+        """
+        Создает фабрику из файла, сохраненного save.
+
+        :param path: Путь к файлу
+        :param params: Параметры, не сохраняемые в файле (quiet,
+            callbacks, evaluation_cache), или заменяющие сохраненные
+        """
+
+        with np.load(path) as state:
+            state = dict(state)
+        params = dict(json.loads(state["params"].item()), **params)
+        factory = cls(state_items(state),
+                      item_numbers=state.get("item_positions"), **params)
+        factory.set_state(state)
+        return factory
+
     def print_hyperparams(self):
         print(f"aplha = {self.alpha}")
         print(f"max_generations = {self.max_generations}")
         print(f"max_specimen = {self.max_specimen}")
         print(f"crossover_type = {self.crossover_type}")
+        print(f"mutation_type = {self.mutation_type}")
+        print(f"engine = {self.engine}")
+        print(f"types_count = {self.types_count} из {len(self.all_items)}")
+        print(f"repair_fill = {self.repair_fill}")
+        print(f"selection_type = {self.selection_type}")
         print(f"crossover_probability = {self.crossover_probability:.4f}")
         print(f"mutation_probability = {self.mutation_probability:.4f}\n")
 
 
+def get_upper_bound(items, max_volume, max_resources=None):
+    """
+    Возвращает оценку сверху стоимости рюкзака.
+
+    Оценка -- стоимость рюкзака, целиком заполненного предметом с лучшим
+    отношением стоимости к объему (решение непрерывной релаксации). При
+    дополнительных ресурсах берется наименьшая из таких оценок по каждому
+    ограничению.
+    """
+
+    _, volumes, costs = item_columns(items)
+    weights = volumes[:, None]
+    capacities = np.array([max_volume])
+    if max_resources is not None:
+        weights = np.column_stack([volumes, item_limits(items)[0]])
+        capacities = np.array([max_volume, *max_resources])
+    fits = (weights <= capacities).all(axis=1)
+    if not fits.any():
+        return 0
+    weights = weights[fits]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bounds = np.where(weights > 0,
+                          costs[fits, None] * capacities / weights, np.inf)
+    bound = float(bounds.max(axis=0).min())
+    if costs.dtype.kind in "iu":
+        # при целых стоимостях дробная часть недостижима
+        bound = int(bound + 1e-9)
+    return bound
+
+
+def reduce_items(items, max_volume, max_resources=None):
+    """
+    Возвращает позиции предметов, нужных для поиска оптимума.
+
+    Исключаются предметы, не помещающиеся в рюкзак или с неположительной
+    стоимостью, и доминируемые: предмет j не нужен, если есть предмет i
+    и k = volume_j // volume_i таких, что k * cost_i >= cost_j -- k
+    предметов i не больше по объему и не дешевле одного предмета j.
+    Из одинаковых предметов остается первый. При дополнительных ресурсах
+    или ограниченных количествах доминирование не проверяется.
+
+    :param items: Список всех вещей или ItemCatalog
+    :param max_volume: Максимальная вместимость рюкзака
+    :param max_resources: Ограничения дополнительных ресурсов
+    :return: Список позиций оставшихся предметов по возрастанию
+    """
+
+    _, volumes, costs = item_columns(items)
+    resources, max_counts = item_limits(items)
+    if max_resources is not None or (max_counts != UNLIMITED).any():
+        fits = (volumes <= max_volume) & (costs > 0) & (max_counts > 0)
+        if max_resources is not None:
+            fits &= (resources <= np.array(max_resources)).all(axis=1)
+        return np.flatnonzero(fits).tolist() or list(range(len(items)))
+
+    candidates = np.flatnonzero((volumes <= max_volume) & (costs > 0))
+    if len(candidates) == 0:
+        # ни один предмет не помещается, геном оставляется как есть
+        return list(range(len(items)))
+    # кандидаты по возрастанию объема, при равном объеме -- по убыванию
+    # стоимости, поэтому доминирующий предмет проверяется раньше
+    # (сортировка устойчивая)
+    candidates = candidates[np.lexsort((-costs[candidates],
+                                        volumes[candidates]))]
+    # сначала сразу для всех: предмет не дороже одного из предыдущих
+    # (k >= 1) доминируем, доминирование транзитивно, поэтому результат
+    # проверки ниже не меняется
+    sorted_costs = costs[candidates]
+    previous_max = np.maximum.accumulate(sorted_costs)
+    candidates = candidates[np.concatenate(
+        ([True], sorted_costs[1:] > previous_max[:-1]))]
+    kept = []
+    kept_volumes = np.empty(len(candidates))
+    kept_costs = np.empty(len(candidates))
+    for number, volume, cost in zip(candidates.tolist(),
+                                    volumes[candidates].tolist(),
+                                    costs[candidates].tolist()):
+        n_kept = len(kept)
+        if n_kept and ((volume // kept_volumes[:n_kept])
+                       * kept_costs[:n_kept] >= cost).any():
+            continue
+        kept_volumes[n_kept] = volume
+        kept_costs[n_kept] = cost
+        kept.append(number)
+
+    if not kept:
+        # ни один предмет не помещается, геном оставляется как есть
+        return list(range(len(items)))
+    return sorted(kept)
+
+
+def item_columns(items):
+    """
+    Возвращает номера, объемы и стоимости предметов массивами numpy.
+
+    Для ItemCatalog возвращаются его столбцы без копирования.
+    """
+
+    if isinstance(items, ItemCatalog):
+        return items.numbers, items.volumes, items.costs
+    return (np.array([item.number for item in items]),
+            np.array([item.volume for item in items]),
+            np.array([item.cost for item in items]))
+
+
+def item_limits(items):
+    """
+    Возвращает расход дополнительных ресурсов (предметы × ресурсы) и
+    ограничения количеств предметов (UNLIMITED, если не ограничено).
+    """
+
+    if isinstance(items, ItemCatalog):
+        return items.resources, items.max_counts
+    resources = np.array([tuple(item.resources) for item in items])
+    max_counts = np.array([UNLIMITED if item.max_count is None
+                           else item.max_count for item in items],
+                          dtype=np.int64)
+    return resources.reshape(len(items), -1) if len(items) \
+        else np.zeros((0, 0)), max_counts
+
+
+def select_items(items, numbers):
+    """Возвращает предметы в позициях numbers того же вида, что и items."""
+
+    if isinstance(items, ItemCatalog):
+        return items.take(numbers)
+    return [items[number] for number in numbers]
+
+
+def items_state(items):
+    """Возвращает номера, объемы и стоимости предметов массивами numpy."""
+
+    numbers, volumes, costs = item_columns(items)
+    resources, max_counts = item_limits(items)
+    return {"item_numbers": np.asarray(numbers),
+            "item_volumes": np.asarray(volumes),
+            "item_costs": np.asarray(costs),
+            "item_resources": np.asarray(resources),
+            "item_max_counts": np.asarray(max_counts)}
+
+
+def state_items(state):
+    """Восстанавливает предметы, сохраненные items_state, в ItemCatalog."""
+
+    return ItemCatalog(state["item_volumes"], state["item_costs"],
+                       state["item_numbers"], state.get("item_resources"),
+                       state.get("item_max_counts"))
+
+
+def restore_backpack(items, item_numbers, backpack):
+    """
+    Возвращает особь для исходного списка предметов.
+
+    :param items: Исходный список вещей
+    :param item_numbers: Позиции вещей особи в исходном списке
+    :param backpack: Особь из оставшихся вещей
+    """
+
+    item_counts = [0] * len(items)
+    for number, count in zip(item_numbers, backpack.item_counts):
+        item_counts[number] = count
+    return Backpack(items, item_counts, backpack.cost, backpack.volume)
+
+
+def solve_exact(items, max_volume, n_solutions=1, scale=1):
+    """
+    Решает задачу динамическим программированием по объему.
+
+    Таблица best[v] -- лучшая стоимость рюкзака объема не больше v --
+    обновляется по одному предмету за раз: для предмета объема w ячейки
+    с одинаковым остатком от деления на w образуют столбец, и
+    best[k*w + r] = k*c + max(best[j*w + r] - j*c, j <= k) вычисляется
+    через np.maximum.accumulate. Для восстановления решения хранится
+    номер последнего улучшившего ячейку предмета. Требуются целые
+    объемы, время O(len(items) * max_volume / scale).
+
+    :param items: Список всех вещей
+    :param max_volume: Максимальная вместимость рюкзака
+    :param n_solutions: Количество различных решений: оптимальное и
+        лучшие для меньших объемов рюкзака
+    :param scale: Во сколько раз укрупняются объемы. Объемы предметов
+        округляются вверх, объем рюкзака -- вниз, поэтому решения
+        допустимы, но при scale > 1 могут быть не оптимальны
+    :return: Список Backpack по убыванию стоимости
+    """
+
+    capacity = max_volume // scale
+    _, volumes, costs = item_columns(items)
+    volumes = (-(-volumes // scale)).tolist()
+    # столбцы каталога могут быть узких типов, таблица считается в 64 битах
+    costs = costs.astype(np.result_type(costs, np.int64))
+    best = np.zeros(capacity + 1, dtype=costs.dtype)
+    choice = np.full(capacity + 1, -1, dtype=np.int64)
+    for number, (volume, cost) in enumerate(zip(volumes, costs)):
+        if volume > capacity or cost <= 0:
+            continue
+        n_rows = capacity // volume + 1
+        column = np.full(n_rows * volume, -np.inf)
+        column[:capacity + 1] = best
+        column = column.reshape(n_rows, volume)
+        offsets = (np.arange(n_rows) * cost)[:, None]
+        shifted = column - offsets
+        accumulated = np.maximum.accumulate(shifted, axis=0)
+        # сравнение в сдвинутых значениях не страдает от округления
+        # при дробных стоимостях
+        improved = (accumulated > shifted).reshape(-1)[:capacity + 1]
+        new_best = (accumulated + offsets).reshape(-1)[:capacity + 1]
+        best = np.where(improved, new_best, best).astype(best.dtype)
+        choice[improved] = number
+
+    solutions = []
+    seen = set()
+    for volume in range(capacity, -1, -1):
+        item_counts = [0] * len(items)
+        free_volume = volume
+        while choice[free_volume] != -1:
+            number = choice[free_volume]
+            item_counts[number] += 1
+            free_volume -= volumes[number]
+        item_counts = tuple(item_counts)
+        if item_counts not in seen:
+            seen.add(item_counts)
+            solutions.append(Backpack(items, item_counts))
+            if len(solutions) == n_solutions:
+                break
+    solutions.sort(key=lambda backpack: backpack.cost, reverse=True)
+    return solutions
+
+
+def check_stop(solver, best_cost, stagnation, elapsed, time_budget):
+    """
+    Проверяет критерии остановки эволюции.
+
+    :param solver: BackpackFactory или BackpackFactoryParallelLauncher
+        с параметрами target_cost, patience и upper_bound
+    :param best_cost: Стоимость лучшей найденной особи
+    :param stagnation: Количество шагов без улучшения лучшей особи
+    :param elapsed: Прошедшее время в секундах
+    :param time_budget: Ограничение времени в секундах или None
+    :return: Название сработавшего критерия или None
+    """
+
+    if solver.target_cost is not None and best_cost >= solver.target_cost:
+        return "target_cost"
+    if best_cost >= solver.upper_bound:
+        return "upper_bound"
+    if solver.patience is not None and stagnation >= solver.patience:
+        return "patience"
+    if time_budget is not None and elapsed >= time_budget:
+        return "time_budget"
+    return None
+
+
+def top_indices(values, k):
+    """Возвращает индексы k наибольших значений (в произвольном порядке)."""
+
+    if k <= 0:
+        return np.arange(0)
+    if k >= len(values):
+        return np.arange(len(values))
+    return np.argpartition(values, len(values) - k)[len(values) - k:]
+
+
 class Generation:
     """
     Поколение особей.
@@ -331,6 +2204,10 @@ class Generation:
     def cost(self):
         return sum(item.cost for item in self) / len(self)
 
+    @property
+    def costs(self):
+        return np.array([item.cost for item in self])
+
     def append(self, item):
         self.backpacks.append(item)
 
@@ -345,6 +2222,9 @@ class Generation:
     def __getitem__(self, key):
         return self.backpacks[key]
 
+    def __setitem__(self, key, item):
+        self.backpacks[key] = item
+
     def __delitem__(self, key):
         del self.backpacks[key]
 
@@ -357,31 +2237,145 @@ class Generation:
         return f'''Объекты: {objs}\nПриспособленность поколения: {cost}\n'''
 
 
-class Backpack:
+class MatrixGeneration:
     """
-    Рюкзак.
+    Поколение особей в матричном представлении.
+
+    Особи хранятся строками матрицы количеств, стоимости и объемы
+    вычисляются сразу для всего поколения.
 
     :param items: Список всех вещей
-    :param item_counts: Список из количеств каждой вещи, лежащих в рюкзаке
+    :param item_counts: Матрица количеств (особи × типы предметов)
+    :param costs: Стоимости особей
+    :param volumes: Объемы особей
     """
 
-    def __init__(self, items, item_counts):
+    def __init__(self, items, item_counts, costs, volumes):
         self.items = items
         self.item_counts = item_counts
+        self.costs = costs
+        self.volumes = volumes
 
     @property
     def cost(self):
-        return sum([cnt * item.cost for cnt,
-                    item in zip(self.item_counts, self.items)])
+        return float(self.costs.mean())
 
-    @property
-    def volume(self):
-        return sum([cnt * item.volume for cnt,
-                    item in zip(self.item_counts, self.items)])
+    def append(self, item):
+        self.item_counts = np.vstack([self.item_counts, item.item_counts])
+        self.costs = np.append(self.costs, item.cost)
+        self.volumes = np.append(self.volumes, item.volume)
+
+    def pop(self, key):
+        item = self[key]
+        del self[key]
+        return item
+
+    def __len__(self):
+        return len(self.item_counts)
+
+    def __getitem__(self, key):
+        return Backpack(self.items, self.item_counts[key].tolist(),
+                        self.costs[key].item(), self.volumes[key].item())
+
+    def __setitem__(self, key, item):
+        self.item_counts[key] = item.item_counts
+        self.costs[key] = item.cost
+        self.volumes[key] = item.volume
+
+    def __delitem__(self, key):
+        self.item_counts = np.delete(self.item_counts, key, axis=0)
+        self.costs = np.delete(self.costs, key)
+        self.volumes = np.delete(self.volumes, key)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __repr__(self):
+        objs = "\n".join(backpack.__repr__() for backpack in self)
+        cost = self.cost
+        return f'''Объекты: {objs}\nПриспособленность поколения: {cost}\n'''
+
+
+class Backpack:
+    """
+    Рюкзак.
+
+    Стоимость и объем вычисляются один раз при создании, набор
+    количеств не изменяется.
+
+    :param items: Список всех вещей
+    :param item_counts: Список из количеств каждой вещи, лежащих в рюкзаке
+    :param cost: Стоимость рюкзака (если None, то вычисляется)
+    :param volume: Объем рюкзака (если None, то вычисляется)
+    """
+
+    __slots__ = ("items", "item_counts", "cost", "volume")
+
+    def __init__(self, items, item_counts, cost=None, volume=None):
+        self.items = items
+        self.item_counts = tuple(item_counts)
+        if isinstance(items, ItemCatalog) and (cost is None or volume is None):
+            counts = np.array(self.item_counts)
+            if cost is None:
+                cost = (counts @ items.costs).item()
+            if volume is None:
+                volume = (counts @ items.volumes).item()
+        if cost is None:
+            cost = sum([cnt * item.cost for cnt,
+                        item in zip(self.item_counts, self.items)])
+        if volume is None:
+            volume = sum([cnt * item.volume for cnt,
+                          item in zip(self.item_counts, self.items)])
+        self.cost = cost
+        self.volume = volume
 
     def __repr__(self):
         return "[Стоимость {}; Предметы: {}]".format(
-            self.cost, self.item_counts)
+            self.cost, list(self.item_counts))
+
+
+class EvaluationCache:
+    """
+    Ограниченный LRU кэш вычисленных особей.
+
+    Ключ -- кортеж количеств, значение -- Backpack с уже вычисленными
+    стоимостью и объемом. Размер кэша считается в элементах кортежей,
+    поэтому занимаемая память не зависит от количества типов предметов.
+
+    :param maxsize: Максимальное суммарное количество элементов геномов
+        хранимых особей
+    """
+
+    def __init__(self, maxsize=10 ** 7):
+        self.maxsize = maxsize
+        self.size = 0  # суммарное количество элементов хранимых геномов
+        self.backpacks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, item_counts):
+        backpack = self.backpacks.get(item_counts)
+        if backpack is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.backpacks.move_to_end(item_counts)
+        return backpack
+
+    def put(self, item_counts, backpack):
+        if len(item_counts) > self.maxsize or item_counts in self.backpacks:
+            return
+        self.backpacks[item_counts] = backpack
+        self.size += len(item_counts)
+        while self.size > self.maxsize:
+            self.size -= len(self.backpacks.popitem(last=False)[0])
+
+    def clear(self):
+        self.backpacks.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.backpacks)
 
 
 class Item:
@@ -391,12 +2385,137 @@ class Item:
     :param number: Порядковый номер вещи
     :param volume: Объем вещи
     :param cost: Стоимость вещи
+    :param resources: Расход дополнительных ресурсов одной штукой (см.
+        BackpackFactory, max_resources)
+    :param max_count: Максимальное количество вещи в рюкзаке (если None,
+        то не ограничено)
     """
 
-    def __init__(self, number: int, volume: int, cost: int):
+    def __init__(self, number: int, volume: int, cost: int,
+                 resources: tuple = (), max_count: int = None):
         self.number = number
         self.volume = volume
         self.cost = cost
+        self.resources = tuple(resources)
+        self.max_count = max_count
 
     def __repr__(self):
         return "[Вес: {}. Стоимость: {}]".format(self.volume, self.cost)
+
+
+class ItemCatalog:
+    """
+    Каталог предметов в столбцовом представлении.
+
+    Объемы, стоимости и номера хранятся непрерывными массивами numpy,
+    объекты Item создаются только при обращении по позиции, поэтому
+    каталог можно передавать вместо списка предметов в BackpackFactory
+    и BackpackFactoryParallelLauncher. Каталог, сохраненный save или
+    открытый load, отображается в память только для чтения и
+    передается в другие процессы путем к файлам: каждый процесс
+    открывает те же файлы, и страницы столбцов в памяти общие.
+
+    :param volumes: Объемы предметов
+    :param costs: Стоимости предметов
+    :param numbers: Номера предметов (если None, то позиции)
+    :param resources: Расход дополнительных ресурсов (предметы × ресурсы,
+        если None, то ресурсов нет)
+    :param max_counts: Максимальные количества предметов (UNLIMITED --
+        не ограничено, если None, то не ограничены все)
+    :param path: Каталог с файлами столбцов (см. save)
+    """
+
+    COLUMNS = ("volumes", "costs", "numbers", "resources", "max_counts")
+
+    def __init__(self, volumes, costs, numbers=None, resources=None,
+                 max_counts=None, path=None):
+        self.volumes = np.asarray(volumes)
+        self.costs = np.asarray(costs)
+        n_items = len(self.volumes)
+        if numbers is None:
+            numbers = np.arange(n_items)
+        self.numbers = np.asarray(numbers)
+        if resources is None:
+            resources = np.zeros((n_items, 0), dtype=self.volumes.dtype)
+        self.resources = np.asarray(resources)
+        if max_counts is None:
+            max_counts = np.full(n_items, UNLIMITED)
+        self.max_counts = np.asarray(max_counts)
+        assert self.volumes.ndim == 1 and self.resources.ndim == 2 and \
+            n_items == len(self.costs) == len(self.numbers) == \
+            len(self.resources) == len(self.max_counts)
+        self.path = path
+
+    @classmethod
+    def from_items(cls, items):
+        """Создает каталог из списка Item."""
+
+        numbers, volumes, costs = item_columns(items)
+        return cls(volumes, costs, numbers, *item_limits(items))
+
+    def save(self, path):
+        """
+        Сохраняет столбцы файлами volumes.npy, costs.npy, numbers.npy,
+        resources.npy и max_counts.npy в каталог path.
+        """
+
+        os.makedirs(path, exist_ok=True)
+        for column in self.COLUMNS:
+            np.save(os.path.join(path, f"{column}.npy"), getattr(self, column))
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        """
+        Открывает столбцы, сохраненные save, отображением в память.
+        Обязательны только volumes.npy и costs.npy.
+        """
+
+        columns = {}
+        for column in cls.COLUMNS:
+            file_path = os.path.join(path, f"{column}.npy")
+            if column in ("volumes", "costs") or os.path.exists(file_path):
+                columns[column] = np.load(file_path, mmap_mode="r")
+        return cls(**columns, path=path)
+
+    def take(self, positions):
+        """
+        Возвращает каталог из предметов в позициях positions (в памяти).
+        Если positions -- все позиции по порядку, возвращается сам каталог.
+        """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) == len(self) and \
+                (positions == np.arange(len(self))).all():
+            return self
+        return ItemCatalog(self.volumes[positions], self.costs[positions],
+                           self.numbers[positions], self.resources[positions],
+                           self.max_counts[positions])
+
+    def __reduce__(self):
+        if self.path is not None:
+            return ItemCatalog.load, (self.path,)
+        return ItemCatalog, (self.volumes, self.costs, self.numbers,
+                             self.resources, self.max_counts)
+
+    def __len__(self):
+        return len(self.volumes)
+
+    def __getitem__(self, position):
+        max_count = self.max_counts[position].item()
+        return Item(self.numbers[position].item(),
+                    self.volumes[position].item(),
+                    self.costs[position].item(),
+                    self.resources[position].tolist(),
+                    None if max_count == UNLIMITED else max_count)
+
+    def __iter__(self):
+        return (Item(number, volume, cost, resources,
+                     None if max_count == UNLIMITED else max_count)
+                for number, volume, cost, resources, max_count in zip(
+                    self.numbers.tolist(), self.volumes.tolist(),
+                    self.costs.tolist(), self.resources.tolist(),
+                    self.max_counts.tolist()))
+
+    def __repr__(self):
+        return f"ItemCatalog({len(self)} предметов)"
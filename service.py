@@ -0,0 +1,327 @@
+"""
+Сервис решения задач о рюкзаке.
+
+Принимает задачи строками JSON по TCP (формат задачи как в batch.py,
+дополнительно "time_budget" -- ограничение времени в секундах), ставит
+их в очередь и решает в заранее запущенном пуле процессов. Ответ --
+строка JSON с результатом batch.solve_task (или "error"), временем
+ожидания в очереди и полной задержкой; ответы на одно соединение
+приходят по мере готовности. Пока все процессы пула заняты, задачи,
+решаемые динамическим программированием (BackpackFactory.exact),
+собираются в пачки и решаются в одном процессе.
+
+Запрос {"command": "metrics"} возвращает длину очереди, число решаемых
+и решенных задач и процентили задержки.
+
+Пример:
+    python service.py --port 7000 --workers 8
+    echo '{"id": 1, "items": [[3, 5], [4, 7]], "max_volume": 20}' | nc localhost 7000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from batch import solve_task
+
+
+def solve_tasks(tasks):
+    """
+    Решает пачку задач в одном процессе, ошибки возвращаются по задачам.
+
+    Время решения предыдущих задач пачки вычитается из ограничения
+    времени следующих.
+    """
+
+    results = []
+    start = time.perf_counter()
+    for task in tasks:
+        params = task.get("params", {})
+        if params.get("time_budget") is not None:
+            time_budget = params["time_budget"] - (time.perf_counter() - start)
+            task = dict(task, params=dict(params,
+                                          time_budget=max(time_budget, 0)))
+        try:
+            results.append(solve_task(task))
+        except Exception as e:
+            results.append({"id": task.get("id"), "error": repr(e)})
+    return results
+
+
+def warm_up():
+    """Пустая задача, после которой процесс пула готов к работе."""
+
+    return os.getpid()
+
+
+class SolverService:
+    """
+    Сервис, решающий задачи из очереди в пуле процессов.
+
+    :param workers: Количество процессов пула (по умолчанию по числу ядер)
+    :param queue_size: Максимальная длина очереди, задачи сверх нее
+        отклоняются
+    :param time_budget: Ограничение времени задачи по умолчанию в секундах.
+        Время ожидания в очереди вычитается из ограничения, по его
+        истечении возвращается лучшая найденная особь
+    :param small_size: Задачи с произведением количества предметов на
+        объем рюкзака больше small_size не проверяются на решение
+        динамическим программированием и не попадают в пачки
+    :param batch_size: Максимальное количество задач в пачке
+    :param batch_delay: Время ожидания следующей задачи в пачку
+        в секундах
+    :param n_latencies: Количество последних задержек для процентилей
+    """
+
+    def __init__(self,
+                 workers=None,
+                 queue_size=1000,
+                 time_budget=10.,
+                 small_size=10 ** 5,
+                 batch_size=32,
+                 batch_delay=.005,
+                 n_latencies=10000):
+        self.workers = workers or os.cpu_count()
+        self.queue = asyncio.Queue(queue_size)
+        self.time_budget = time_budget
+        self.small_size = small_size
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        # не больше одного задания на процесс, остальные ждут в очереди
+        self.slots = asyncio.Semaphore(self.workers)
+        self.executor = None
+        self.latencies = deque(maxlen=n_latencies)
+        self.counters = {"received": 0,
+                         "rejected": 0,
+                         "solved": 0,
+                         "errors": 0,
+                         "batches": 0,
+                         "in_flight": 0}
+
+    async def start(self, host="localhost", port=7000):
+        """Запускает пул процессов, обработчик очереди и сервер."""
+
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, warm_up)
+                               for _ in range(self.workers)))
+        self.dispatcher = asyncio.create_task(self.dispatch())
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self):
+        self.dispatcher.cancel()
+        self.executor.shutdown(cancel_futures=True)
+
+    def is_small(self, task):
+        try:
+            return len(task["items"]) * task["max_volume"] <= self.small_size
+        except (KeyError, TypeError):
+            # некорректная задача решается отдельно и возвращает ошибку
+            return False
+
+    def is_exact(self, task):
+        """
+        Проверяет, что задача будет решена динамическим программированием
+        (условие BackpackFactory.exact) и может быть добавлена в пачку.
+
+        Условие проверяется по самой задаче без создания фабрики, чтобы
+        не задерживать обработку соединений: объемы целые, нет
+        ограничений ресурсов и количеств, и произведение количества
+        предметов на объем рюкзака не больше exact_threshold.
+        """
+
+        if task.get("launcher") or not self.is_small(task):
+            return False
+        params = task.get("params", {})
+        # порог по умолчанию -- как в BackpackFactory
+        exact_threshold = params.get("exact_threshold", 10 ** 6)
+        try:
+            return params.get("max_resources") is None and \
+                exact_threshold is not None and \
+                len(task["items"]) * task["max_volume"] <= exact_threshold and \
+                all(isinstance(item[0], int) and
+                    (len(item) < 4 or item[3] is None)
+                    for item in task["items"])
+        except (TypeError, IndexError):
+            return False
+
+    def metrics(self):
+        """Возвращает длину очереди, счетчики и процентили задержки."""
+
+        latencies = np.array(self.latencies)
+        percentiles = {}
+        if len(latencies):
+            percentiles = dict(zip(
+                ("p50", "p90", "p99", "max"),
+                np.percentile(latencies, [50, 90, 99, 100]).tolist()))
+        return {"queue_depth": self.queue.qsize(),
+                **self.counters,
+                "latency": percentiles}
+
+    async def submit(self, task):
+        """Ставит задачу в очередь и возвращает результат."""
+
+        self.counters["received"] += 1
+        params = task.get("params", {})
+        if not isinstance(params, dict) or not isinstance(
+                task.get("time_budget", params.get("time_budget")),
+                (int, float, type(None))):
+            self.counters["errors"] += 1
+            return {"id": task.get("id"),
+                    "error": "params must be an object and time_budget a number"}
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((task, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            return {"id": task.get("id"), "error": "queue is full"}
+        return await future
+
+    async def dispatch(self):
+        """
+        Забирает задачи из очереди и отправляет их в пул.
+
+        Задачи, решаемые динамическим программированием, собираются в
+        пачку, только пока все процессы заняты: до освобождения процесса,
+        заполнения пачки, задачи другого вида или паузы очереди в
+        batch_delay секунд. Остальные задачи отправляются по одной.
+        """
+
+        while True:
+            request = await self.queue.get()
+            requests = [request]
+            deferred = None
+            if self.is_exact(request[0]):
+                while self.slots.locked() and len(requests) < self.batch_size:
+                    try:
+                        request = await asyncio.wait_for(self.queue.get(),
+                                                         self.batch_delay)
+                    except asyncio.TimeoutError:
+                        break
+                    if not self.is_exact(request[0]):
+                        # задача эволюции отправляется отдельно после пачки
+                        deferred = request
+                        break
+                    requests.append(request)
+
+            await self.slots.acquire()
+            asyncio.create_task(self.run(requests))
+            if deferred is not None:
+                await self.slots.acquire()
+                asyncio.create_task(self.run([deferred]))
+
+    async def run(self, requests):
+        """Решает пачку задач в пуле и передает результаты ожидающим."""
+
+        tasks = []
+        now = time.perf_counter()
+        for task, _, arrival in requests:
+            params = dict(task.get("params", {}))
+            time_budget = task.get("time_budget",
+                                   params.get("time_budget", self.time_budget))
+            if time_budget is not None:
+                params["time_budget"] = max(time_budget - (now - arrival), 0)
+            tasks.append(dict(task, params=params))
+
+        self.counters["in_flight"] += len(tasks)
+        self.counters["batches"] += 1
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, solve_tasks, tasks)
+        except Exception as e:
+            results = [{"id": task.get("id"), "error": repr(e)}
+                       for task in tasks]
+        finally:
+            self.counters["in_flight"] -= len(tasks)
+            self.slots.release()
+
+        done = time.perf_counter()
+        for (task, future, arrival), result in zip(requests, results):
+            latency = done - arrival
+            self.latencies.append(latency)
+            if "error" in result:
+                self.counters["errors"] += 1
+            else:
+                self.counters["solved"] += 1
+            result.update({"queue_time": now - arrival, "latency": latency})
+            if not future.done():
+                future.set_result(result)
+
+    async def handle_connection(self, reader, writer):
+        """Читает задачи соединения и пишет ответы по мере готовности."""
+
+        responses = set()
+
+        async def respond(request):
+            if request.get("command") == "metrics":
+                result = self.metrics()
+            else:
+                result = await self.submit(request)
+            writer.write((json.dumps(result) + "\n").encode())
+            await writer.drain()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                writer.write((json.dumps({"error": repr(e)}) + "\n").encode())
+                continue
+            if not isinstance(request, dict):
+                writer.write((json.dumps({"error": "request is not an object"})
+                              + "\n").encode())
+                continue
+            response = asyncio.create_task(respond(request))
+            responses.add(response)
+            response.add_done_callback(responses.discard)
+
+        await asyncio.gather(*responses)
+        writer.close()
+
+
+async def serve(args):
+    service = SolverService(workers=args.workers,
+                            queue_size=args.queue_size,
+                            time_budget=args.time_budget,
+                            batch_size=args.batch_size,
+                            batch_delay=args.batch_delay)
+    server = await service.start(args.host, args.port)
+    print(f"Сервис запущен на {args.host}:{args.port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Количество процессов (по умолчанию по числу ядер)")
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--time-budget", type=float, default=10.,
+                        help="Ограничение времени задачи по умолчанию, с")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batch-delay", type=float, default=.005,
+                        help="Ожидание задач в пачку, с")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Проверки распределенного запуска популяций на рабочих.
+
+Запуск:
+    python -m pytest -q
+"""
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from distributed import Coordinator, run_worker
+from models import BackpackFactoryParallelLauncher, Item, ItemCatalog
+
+AUTHKEY = b"test"
+
+
+def start_workers(n_workers):
+    """Запускает координатора и n_workers рабочих в отдельных процессах."""
+
+    coordinator = Coordinator(("localhost", 0), AUTHKEY)
+    workers = [multiprocessing.Process(target=run_worker,
+                                       args=(coordinator.address, AUTHKEY),
+                                       daemon=True)
+               for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    coordinator.accept(n_workers)
+    return coordinator, workers
+
+
+def test_missing_catalog_is_reported_by_worker():
+    rng = np.random.default_rng(0)
+    # каталог с путем, которого нет у рабочего
+    catalog = ItemCatalog(rng.integers(1, 20, 30), rng.integers(1, 50, 30),
+                          path="/nonexistent/catalog")
+    coordinator, workers = start_workers(1)
+    try:
+        launcher = BackpackFactoryParallelLauncher(
+            catalog, 100, n_populations=1, n_migrations=2,
+            preprocess=False, coordinator=coordinator, quiet=True, seed=0)
+        with pytest.raises(FileNotFoundError):
+            launcher.solve()
+        assert workers[0].is_alive()
+        assert coordinator.workers[0].alive
+    finally:
+        coordinator.close()
+    workers[0].join(10)
+
+
+def test_islands_survive_worker_drop_out():
+    rng = np.random.default_rng(1)
+    items = [Item(number, int(volume), int(cost)) for number, (volume, cost)
+             in enumerate(rng.integers(10, 90, (30, 2)))]
+    coordinator, workers = start_workers(2)
+
+    def kill_worker(event):
+        if event["event"] == "migration" and event["migration"] == 1:
+            workers[0].terminate()
+            workers[0].join()
+
+    try:
+        launcher = BackpackFactoryParallelLauncher(
+            items, 997, n_populations=4, n_migrations=4, migration_delay=5,
+            epsilon=None, preprocess=False, exact_threshold=None,
+            coordinator=coordinator, quiet=True, seed=0,
+            callbacks=[kill_worker])
+        backpack = launcher.solve()
+        assert launcher.stop_reason == "n_migrations"
+        assert backpack.volume <= 997
+        assert [worker.alive for worker in coordinator.workers].count(False) \
+            == 1
+        # популяции упавшего рабочего созданы заново на оставшемся
+        assert all(island.local_island is None and island.worker.alive
+                   for island in launcher.populations)
+    finally:
+        coordinator.close()
+    workers[1].join(10)
@@ -0,0 +1,325 @@
+"""
+Проверки генетического алгоритма и точного решения.
+
+Запуск:
+    python -m pytest -q
+"""
+import itertools
+import pickle
+
+import numpy as np
+
+from models import (Backpack, BackpackFactory, BackpackFactoryParallelLauncher,
+                    EvaluationCache, Item, ItemCatalog, reduce_items,
+                    restore_backpack, solve_exact)
+
+
+def random_items(rng, types_count, max_item_volume=8, max_item_cost=20):
+    return [Item(number, int(rng.integers(1, max_item_volume + 1)),
+                 int(rng.integers(0, max_item_cost + 1)))
+            for number in range(types_count)]
+
+
+def brute_force(items, max_volume):
+    """Лучшая стоимость перебором всех допустимых количеств."""
+
+    ranges = [range(max_volume // item.volume + 1) for item in items]
+    best = 0
+    for item_counts in itertools.product(*ranges):
+        volume = sum(count * item.volume
+                     for count, item in zip(item_counts, items))
+        if volume <= max_volume:
+            best = max(best, sum(count * item.cost
+                                 for count, item in zip(item_counts, items)))
+    return best
+
+
+def test_solve_exact_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        items = random_items(rng, int(rng.integers(1, 5)))
+        max_volume = int(rng.integers(0, 16))
+        backpack = solve_exact(items, max_volume)[0]
+        assert backpack.cost == brute_force(items, max_volume)
+        assert backpack.volume <= max_volume
+
+
+def test_solve_exact_solutions_are_distinct_and_feasible():
+    rng = np.random.default_rng(1)
+    items = random_items(rng, 4)
+    backpacks = solve_exact(items, 15, n_solutions=5)
+    assert len({backpack.item_counts for backpack in backpacks}) == \
+        len(backpacks)
+    assert all(backpack.volume <= 15 for backpack in backpacks)
+    costs = [backpack.cost for backpack in backpacks]
+    assert costs == sorted(costs, reverse=True)
+
+
+def test_reduce_items_keeps_optimum():
+    rng = np.random.default_rng(2)
+    for _ in range(50):
+        items = random_items(rng, int(rng.integers(1, 6)))
+        max_volume = int(rng.integers(0, 16))
+        item_numbers = reduce_items(items, max_volume)
+        reduced = [items[number] for number in item_numbers]
+        assert brute_force(reduced, max_volume) == \
+            brute_force(items, max_volume)
+        backpack = restore_backpack(items, item_numbers,
+                                    solve_exact(reduced, max_volume)[0])
+        assert len(backpack.item_counts) == len(items)
+
+
+def test_reduce_items_keeps_genome_when_nothing_fits():
+    assert reduce_items([Item(0, 5, 3)], 2) == [0]
+    assert reduce_items([Item(0, 1, 0), Item(1, 2, -1)], 2) == [0, 1]
+    factory = BackpackFactory([Item(0, 5, 3)], 2, quiet=True, seed=0)
+    assert factory.solve().cost == 0
+
+
+def test_constrained_generations_are_feasible():
+    rng = np.random.default_rng(3)
+    items = [Item(number, int(rng.integers(1, 30)), int(rng.integers(1, 60)),
+                  (int(rng.integers(0, 20)), int(rng.integers(1, 10))),
+                  int(rng.integers(1, 4)) if number % 3 == 0 else None)
+             for number in range(30)]
+    max_resources = [150, 60]
+    weights = np.array([[item.volume, *item.resources] for item in items])
+    capacities = np.array([200, *max_resources])
+    bounds = np.array([np.inf if item.max_count is None else item.max_count
+                       for item in items])
+
+    for engine in ("python", "numpy"):
+        for crossover_type in ("avg", "rand"):
+            for mutation_type in ("random", "point"):
+                factory = BackpackFactory(
+                    items, 200, max_resources=max_resources, engine=engine,
+                    crossover_type=crossover_type,
+                    mutation_type=mutation_type, max_generations=30,
+                    preprocess=False, epsilon=None, quiet=True, seed=0)
+                factory.evolve()
+                item_counts = np.array([backpack.item_counts
+                                        for backpack in factory.cur_generation])
+                assert ((item_counts @ weights <= capacities).all()
+                        and (item_counts <= bounds).all())
+                assert factory.batch_feasible(item_counts).all()
+                assert not factory.batch_feasible(
+                    item_counts + factory.item_bounds).any()
+
+
+def test_checkpoint_round_trip(tmp_path):
+    rng = np.random.default_rng(4)
+    items = random_items(rng, 40, max_item_volume=50, max_item_cost=100)
+    path = str(tmp_path / "factory.npz")
+    for engine in ("python", "numpy"):
+        factory = BackpackFactory(items, 500, engine=engine, epsilon=None,
+                                  exact_threshold=None, max_generations=10,
+                                  quiet=True, seed=0)
+        factory.evolve()
+        factory.save(path)
+        loaded = BackpackFactory.load(path, quiet=True)
+
+        assert loaded.item_numbers == factory.item_numbers
+        assert loaded.best_backpack.item_counts == \
+            factory.best_backpack.item_counts
+        assert loaded.epochs_evolved == factory.epochs_evolved
+        # продолжение с загруженного состояния совпадает с непрерывным
+        factory.evolve()
+        loaded.evolve()
+        assert np.array_equal(
+            [backpack.item_counts for backpack in loaded.cur_generation],
+            [backpack.item_counts for backpack in factory.cur_generation])
+
+
+def test_launcher_islands_share_mapped_catalog(tmp_path):
+    rng = np.random.default_rng(5)
+    items = random_items(rng, 60, max_item_volume=50, max_item_cost=100)
+    path = str(tmp_path / "catalog")
+    ItemCatalog.from_items(items).save(path)
+    catalog = ItemCatalog.load(path)
+    assert catalog.take(range(len(catalog))) is catalog
+    # передается путем и в другом процессе снова отображается в память
+    assert isinstance(pickle.loads(pickle.dumps(catalog)).volumes.base,
+                      np.memmap)
+
+    for preprocess in (False, True):
+        params = dict(max_volume=300, n_populations=2, n_migrations=3,
+                      migration_delay=5, preprocess=preprocess,
+                      exact_threshold=None, parallel=False, quiet=True,
+                      seed=0)
+        launcher = BackpackFactoryParallelLauncher(catalog, **params)
+        for island in launcher.populations:
+            factory = island.factory
+            assert factory.all_items is catalog
+            if not preprocess:
+                # все предметы остались: столбцы не копируются
+                assert factory.items is catalog
+                assert isinstance(factory.item_volumes.base, np.memmap)
+            assert factory.item_numbers == launcher.item_numbers
+        backpack = launcher.solve()
+        expected = BackpackFactoryParallelLauncher(items, **params).solve()
+        assert backpack.item_counts == expected.item_counts
+
+
+def test_evaluation_cache_is_bounded_by_genome_elements():
+    cache = EvaluationCache(10)
+    for count in range(5):
+        cache.put((count,) * 4, count)
+    # помещаются две особи по четыре элемента
+    assert len(cache) == 2 and cache.size == 8
+    assert cache.get((0,) * 4) is None and cache.get((4,) * 4) == 4
+    cache.put((0,) * 11, 0)
+    assert len(cache) == 2
+    cache.clear()
+    assert len(cache) == 0 and cache.size == 0
+
+
+def test_repair_keeps_integer_counts_with_float_volumes():
+    items = [Item(0, 1.5, 3), Item(1, 2.25, 5)]
+    for repair_fill in (False, True):
+        factory = BackpackFactory(items, 9, repair_fill=repair_fill,
+                                  preprocess=False, exact_threshold=None,
+                                  quiet=True, seed=0)
+        backpack = factory.repair(Backpack(items, (3, 4)))
+        assert all(type(count) is int for count in backpack.item_counts)
+        assert backpack.volume <= 9
+
+
+def test_point_mutation_keeps_integer_counts_with_float_volumes():
+    items = [Item(0, 1.5, 3), Item(1, 2.25, 5)]
+    factory = BackpackFactory(items, 9, preprocess=False, exact_threshold=None,
+                              quiet=True, seed=0)
+    for operation in range(4):
+        for added_number in range(len(items)):
+            backpack = factory.point_mutation(Backpack(items, (1, 1)),
+                                              operation, .5, added_number)
+            assert all(type(count) is int for count in backpack.item_counts)
+            assert backpack.volume <= 9
+    assert type(factory.item_fits([0, 0], 0, 1)) is int
+
+
+def test_launcher_without_migrations_returns_start_best():
+    items = random_items(np.random.default_rng(6), 10)
+    launcher = BackpackFactoryParallelLauncher(
+        items, 30, n_populations=2, n_migrations=0, exact_threshold=None,
+        parallel=False, quiet=True, seed=0)
+    backpack = launcher.solve()
+    assert backpack.volume <= 30
+    assert backpack.cost == max(island.factory.best_backpack.cost
+                                for island in launcher.populations)
+
+
+def generation_counts(factory):
+    """Матрица количеств текущего поколения фабрики любого движка."""
+
+    return np.array([backpack.item_counts
+                     for backpack in factory.cur_generation])
+
+
+def test_retarget_carries_generation_over():
+    rng = np.random.default_rng(7)
+    items = random_items(rng, 30, max_item_volume=50, max_item_cost=100)
+    for engine in ("python", "numpy"):
+        factory = BackpackFactory(items, 500, engine=engine, preprocess=False,
+                                  exact_threshold=None, epsilon=None,
+                                  max_generations=20, quiet=True, seed=0)
+        factory.evolve()
+
+        # без первого предмета количества остальных переносятся по номерам
+        # и только дополняются в освободившийся объем
+        old_counts = generation_counts(factory)
+        factory.retarget(items[1:])
+        item_counts = generation_counts(factory)
+        assert (item_counts >= old_counts[:, 1:]).all()
+
+        # при меньшем объеме особи исправляются
+        factory.retarget(max_volume=200)
+        item_counts = generation_counts(factory)
+        volumes = np.array([item.volume for item in items[1:]])
+        costs = np.array([item.cost for item in items[1:]])
+        assert (item_counts @ volumes <= 200).all()
+        assert factory.best_backpack.cost == (item_counts @ costs).max()
+
+        factory.evolve(max_generations=5)
+        assert factory.best_backpack.volume <= 200
+
+    launcher = BackpackFactoryParallelLauncher(
+        items, 500, n_populations=2, n_migrations=2, migration_delay=5,
+        exact_threshold=None, parallel=False, quiet=True, seed=0)
+    launcher.solve()
+    launcher.retarget(max_volume=200)
+    backpack = launcher.solve()
+    assert len(backpack.item_counts) == len(items)
+    assert backpack.volume <= 200
+
+
+def test_migration_keeps_sizes_and_follows_topology():
+    items = random_items(np.random.default_rng(8), 20, max_item_volume=30,
+                         max_item_cost=60)
+    params = {"alpha": 2, "max_specimen": 30, "crossover_type": "avg",
+              "crossover_probability": .9, "mutation_probability": .1}
+
+    def create_launcher(topology, policy="replace_worst", migration_proba=.5):
+        return BackpackFactoryParallelLauncher(
+            items, 200, n_populations=4, populations_params=[params] * 4,
+            migration_proba=migration_proba, migration_topology=topology,
+            migration_policy=policy, exact_threshold=None, parallel=False,
+            quiet=True, seed=0)
+
+    for topology in ("ring", "random", "full", "star"):
+        for policy in ("replace_worst", "replace_random"):
+            launcher = create_launcher(topology, policy)
+            launcher.call_populations("evolve", 3)
+            launcher.migrate()
+            assert [len(island.factory.cur_generation)
+                    for island in launcher.populations] == [30] * 4
+
+    assert [create_launcher("ring").get_neighbours(number)
+            for number in range(4)] == [[1], [2], [3], [0]]
+    assert [create_launcher("star").get_neighbours(number)
+            for number in range(4)] == [[1, 2, 3], [0], [0], [0]]
+    assert create_launcher("full").get_neighbours(2) == [0, 1, 3]
+
+    # все особи уходят в следующую популяцию и вытесняют ее особей
+    launcher = create_launcher("ring", migration_proba=1)
+    best_costs = [summary["best_cost"]
+                  for summary in launcher.call_populations("evolve", 3)]
+    launcher.migrate()
+    for number, island in enumerate(launcher.populations):
+        assert island.factory.cur_generation.costs.max() == \
+            best_costs[number - 1]
+
+
+def test_halving_schedule_replaces_slowest_populations():
+    items = random_items(np.random.default_rng(9), 30, max_item_volume=30,
+                         max_item_cost=60)
+    launcher = BackpackFactoryParallelLauncher(
+        items, 997, n_populations=4, scheduler="halving", schedule_fraction=.5,
+        preprocess=False, exact_threshold=None, parallel=False, quiet=True,
+        seed=0)
+    summaries = launcher.call_populations("evolve", 3)
+    # прирост стоимости на секунду: 2 и 0 -- худшие популяции
+    for summary, cpu_time in zip(summaries, (4., 1., 3., 2.)):
+        summary["cpu_time"] = cpu_time
+    old_populations = list(launcher.populations)
+
+    replaced = launcher.schedule(summaries)
+    assert sorted(loser for loser, _ in replaced) == [0, 2]
+    for loser, winner in replaced:
+        assert winner in (1, 3)
+        assert launcher.populations[loser] is not old_populations[loser]
+        assert 25 <= launcher.populations_params[loser]["max_specimen"] <= 1000
+        # стартовое поколение начинается с лучших особей победителя
+        launcher.populations[loser].send("evolve", 0)
+        assert launcher.populations[loser].recv()["best_cost"] >= \
+            summaries[winner]["best_cost"]
+    assert launcher.populations[1] is old_populations[1]
+
+    events = []
+    launcher = BackpackFactoryParallelLauncher(
+        items, 997, n_populations=4, n_migrations=3, migration_delay=5,
+        epsilon=None, scheduler="halving", schedule_interval=1,
+        preprocess=False, exact_threshold=None, parallel=False, quiet=True,
+        seed=0, callbacks=[events.append])
+    launcher.solve()
+    assert [event["migration"] for event in events
+            if event["event"] == "schedule"] == [1, 2]
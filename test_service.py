@@ -0,0 +1,112 @@
+"""
+Проверки сервиса решения задач.
+
+Запуск:
+    python -m pytest -q
+"""
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from batch import task_items
+from models import BackpackFactory
+from service import SolverService, solve_tasks
+
+
+async def exchange(requests, **service_params):
+    """
+    Запускает сервис, отправляет запросы по одному соединению и
+    возвращает ответы по полю "id" (ответы без "id" -- списком под None).
+    """
+
+    service = SolverService(**service_params)
+    server = await service.start("localhost", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("localhost", port)
+        for request in requests:
+            line = request if isinstance(request, str) else json.dumps(request)
+            writer.write((line + "\n").encode())
+        await writer.drain()
+        responses = {None: []}
+        for _ in requests:
+            response = json.loads(await reader.readline())
+            if response.get("id") is None:
+                responses[None].append(response)
+            else:
+                responses[response["id"]] = response
+        writer.close()
+        await writer.wait_closed()
+        return responses, service.metrics()
+    finally:
+        server.close()
+        service.close()
+
+
+def test_malformed_requests_get_errors():
+    task = {"items": [[3, 5], [4, 7]], "max_volume": 20}
+    responses, metrics = asyncio.run(exchange(
+        ["[1, 2]", "{", dict(task, id="params", params=5),
+         dict(task, id="budget", time_budget="soon"), dict(task, id="ok")],
+        workers=1))
+
+    assert [response["error"] for response in responses[None]] == \
+        ["request is not an object", responses[None][1]["error"]]
+    assert "error" in responses["params"] and "error" in responses["budget"]
+    assert responses["ok"]["cost"] == 35
+    assert metrics["solved"] == 1 and metrics["errors"] == 2
+
+
+def test_is_exact_matches_factory():
+    service = SolverService(workers=1)
+    items = [[3, 5], [4, 7], [5, 9]]
+    tasks = [{"items": items, "max_volume": 50},
+             {"items": items, "max_volume": 50,
+              "params": {"exact_threshold": None}},
+             {"items": items, "max_volume": 50,
+              "params": {"exact_threshold": 100}},
+             {"items": [[3.5, 5], [4, 7]], "max_volume": 50},
+             {"items": [[3, 5, [1]], [4, 7, [2]]], "max_volume": 50,
+              "params": {"max_resources": [10]}},
+             {"items": [[3, 5, [], 2], [4, 7]], "max_volume": 50}]
+    for task in tasks:
+        factory = BackpackFactory(task_items(task), task["max_volume"],
+                                  quiet=True, **task.get("params", {}))
+        assert service.is_exact(task) == factory.exact
+    assert not service.is_exact(dict(tasks[0], launcher=True))
+    assert not service.is_exact({"catalog": "catalog", "max_volume": 50})
+    assert not service.is_exact({"items": [5], "max_volume": 50})
+
+
+def test_exact_tasks_are_batched_only_while_workers_are_busy():
+    rng = np.random.default_rng(0)
+    items = rng.integers(10, 90, (40, 2)).tolist()
+    evolving = {"id": "evolving", "items": items, "max_volume": 997,
+                "time_budget": .5,
+                "params": {"exact_threshold": None, "preprocess": False,
+                           "epsilon": None, "max_generations": 10 ** 9}}
+    exact = [{"id": number, "items": items[:5], "max_volume": 100}
+             for number in range(8)]
+    responses, metrics = asyncio.run(exchange([evolving, *exact], workers=2))
+
+    assert metrics["solved"] == 9
+    assert responses["evolving"]["generations"] > 0
+    # первая точная задача сразу занимает свободный процесс, остальные
+    # ждут его освобождения пачками
+    assert responses[0]["queue_time"] < .1
+    assert metrics["batches"] < 1 + len(exact)
+
+
+def test_solve_tasks_shares_time_budget():
+    rng = np.random.default_rng(1)
+    task = {"items": rng.integers(10, 90, (40, 2)).tolist(), "max_volume": 997,
+            "params": {"exact_threshold": None, "preprocess": False,
+                       "epsilon": None, "max_generations": 10 ** 9,
+                       "time_budget": .3}}
+    start = time.perf_counter()
+    results = solve_tasks([task, task, task])
+    # последующие задачи пачки получают остаток ограничения
+    assert time.perf_counter() - start < .6
+    assert all("error" not in result for result in results)